@@ -6,6 +6,7 @@ from django.conf import settings
 from .serializers import ContactSerializer
 
 from orders.models import Order
+from orders.pagination import OrderCursorPagination
 
 
 class ContactView(APIView):
@@ -43,16 +44,22 @@ class MeView(APIView):
 
         user = request.user
 
-        orders = Order.objects.filter(user=user)
+        # one page of order summaries, only the columns shown (see orders/pagination.py)
+        paginator = OrderCursorPagination()
+        orders = paginator.paginate_queryset(
+            Order.objects.filter(user=user).values('id', 'status', 'total_price', 'created_at', 'address', 'phone'),
+            request,
+            view=self,
+        )
 
         orders_data = [
             {
-                "id": o.id,
-                "status": o.status,
-                "total": o.total_price,
-                "created": o.created_at,
-                "address": o.address,
-                "phonenumber": o.phone
+                "id": o['id'],
+                "status": o['status'],
+                "total": o['total_price'],
+                "created": o['created_at'],
+                "address": o['address'],
+                "phonenumber": o['phone']
             }
             for o in orders
         ]
@@ -60,5 +67,7 @@ class MeView(APIView):
         return Response({
             "username": user.username,
             "email": user.email,
-            "orders": orders_data
+            "orders": orders_data,
+            "orders_next": paginator.get_next_link(),
+            "orders_previous": paginator.get_previous_link()
         })
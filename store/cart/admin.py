@@ -1,5 +1,10 @@
+from decimal import Decimal
 from django.contrib import admin
+from django.db.models import DecimalField, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from .models import Cart, CartItem
+from .pricing import price_cart
+from store.paginator import EstimatedCountPaginator
 # Register your models here.
 
 @admin.register(Cart)
@@ -7,6 +12,30 @@ class CartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'created_at', 'is_active', 'total_price')
     list_filter = ('is_active', 'created_at',)
     search_fields = ('user__username', 'id')
+    list_select_related = ('user', 'coupon')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # items total of each cart as a subquery of the changelist query instead of walking every item
+        items_total = (
+            CartItem.objects.filter(cart=OuterRef('pk'))
+            .values('cart')
+            .annotate(total=Sum(F('quantity') * F('product__final_price')))
+            .values('total')
+        )
+        # the items for pricing, in one query for the whole page
+        items = CartItem.objects.select_related('product').only(
+            'cart', 'quantity', 'product__final_price', 'product__category', 'product__brand'
+        )
+        return super().get_queryset(request).annotate(
+            items_total=Coalesce(Subquery(items_total), Value(Decimal(0)), output_field=DecimalField())
+        ).prefetch_related(Prefetch('items', queryset=items))
+
+    # sorted by the items total, shown with promotions and coupon like the cart itself
+    @admin.display(ordering='items_total')
+    def total_price(self, obj):
+        return price_cart(obj).total
 
 
 @admin.register(CartItem)
@@ -15,3 +44,6 @@ class CartItemAdmin(admin.ModelAdmin):
     list_filter = ('cart__is_active', 'product__name',)
     search_fields = ('product__name', 'cart__user__username')
     readonly_fields = ('total_price',)
+    list_select_related = ('cart__user', 'product')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
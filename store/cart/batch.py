@@ -0,0 +1,83 @@
+MAX_OPERATIONS = 100
+
+class OperationError(Exception):
+    def __init__(self, index, message, status=400):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+        self.status = status
+
+
+class BatchPlan:
+    """
+    The net effect of an ordered list of cart operations:
+
+        {"op": "add", "product": 1, "quantity": 2}
+        {"op": "update", "product": 1, "quantity": 5} (0 removes the item, missing items are added)
+        {"op": "remove", "product": 1}
+        {"op": "apply_coupon", "code": "SAVE10"}
+        {"op": "remove_coupon"}
+
+    Per product the operations fold into either an increment of the stored quantity
+    (adds only) or an absolute quantity (once an update/remove is seen), so the whole
+    batch is written with one statement of each kind whatever its length.
+    """
+
+    def __init__(self, operations, coupon_id):
+        self.increments = {} # product_id -> quantity added to the stored one
+        self.quantities = {} # product_id -> final quantity
+        self.coupon_code = None # code of the coupon applied last
+        self.coupon_changed = False
+        self.coupon_index = None
+        self.indexes = {} # product_id -> index of its first operation, for error reports
+        self.added = set() # products added at some point, they must be in stock
+
+        coupon = coupon_id
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                raise OperationError(index, "Each operation must be an object")
+            op = operation.get('op')
+
+            if op == 'apply_coupon':
+                code = operation.get('code')
+                if not code:
+                    raise OperationError(index, "Coupon code is required")
+                if coupon is not None:
+                    raise OperationError(index, "Cart already has a coupon applied")
+                coupon = code
+                self.coupon_code, self.coupon_changed, self.coupon_index = code, True, index
+                continue
+            if op == 'remove_coupon':
+                coupon = None
+                self.coupon_code, self.coupon_changed, self.coupon_index = None, True, index
+                continue
+            if op not in ('add', 'update', 'remove'):
+                raise OperationError(index, f"Unknown operation {op!r}")
+
+            try:
+                product_id = int(operation.get('product'))
+                quantity = int(operation.get('quantity', 1)) if op != 'remove' else 0
+            except (TypeError, ValueError):
+                raise OperationError(index, "product and quantity must be integers")
+
+            self.indexes.setdefault(product_id, index)
+            if op == 'add':
+                if quantity <= 0:
+                    raise OperationError(index, "Quantity must be positive")
+                self.added.add(product_id)
+                if product_id in self.quantities:
+                    self.quantities[product_id] += quantity
+                else:
+                    self.increments[product_id] = self.increments.get(product_id, 0) + quantity
+            else:
+                # absolute from here on, earlier adds of the product are overridden
+                self.increments.pop(product_id, None)
+                self.quantities[product_id] = max(quantity, 0)
+
+    @property
+    def removed(self):
+        return [product_id for product_id, quantity in self.quantities.items() if quantity == 0]
+
+    @property
+    def updated(self):
+        return {product_id: quantity for product_id, quantity in self.quantities.items() if quantity > 0}
@@ -0,0 +1,106 @@
+import secrets
+from functools import cached_property
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Prefetch
+from products.models import Product, ProductImage
+from .models import CartItem
+from .resolver import active_cart_id
+
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_TTL = 60 * 60 * 24 * 14
+signer = signing.Signer(salt='cart.guest')
+
+def guest_cart_key(token):
+    return f'cart:guest:{token}'
+
+def read_guest_token(request):
+    # token of the guest cart from the signed cookie, None when missing or tampered with
+    value = request.COOKIES.get(GUEST_CART_COOKIE)
+    if not value:
+        return None
+    try:
+        return signer.unsign(value)
+    except signing.BadSignature:
+        return None
+
+
+class GuestItems(list):
+    # quacks like the cart.items manager the serializers and pricing read
+    def all(self):
+        return self
+
+
+class GuestCart:
+    """
+    Cart of an anonymous visitor, {product_id: quantity} stored in the cache under a random
+    token kept in a signed cookie. No database row is written until it is merged into the
+    user's cart at login; it is priced and serialized like a Cart.
+    """
+    id = pk = None
+    user = None
+    is_active = True
+    created_at = None
+    coupon = coupon_id = None # coupons need an account
+
+    def __init__(self, token=None):
+        self.saved = False # the cookie is only (re)set once something is saved
+        self.token = token or secrets.token_urlsafe(18)
+        self.quantities = (cache.get(guest_cart_key(token)) or {}) if token else {}
+
+    @property
+    def cookie(self):
+        return signer.sign(self.token)
+
+    def save(self):
+        cache.set(guest_cart_key(self.token), self.quantities, GUEST_CART_TTL)
+        self.saved = True
+
+    def set_quantity(self, product, quantity):
+        # same cap as the database carts: never more than the stock
+        quantity = min(quantity, product.stock)
+        if quantity > 0:
+            self.quantities[product.id] = quantity
+        else:
+            self.quantities.pop(product.id, None)
+
+    def apply(self, plan, products):
+        # the net effect of a BatchPlan, in the same order as the database writes
+        for product_id in plan.removed:
+            self.quantities.pop(product_id, None)
+        for product_id, quantity in plan.updated.items():
+            self.set_quantity(products[product_id], quantity)
+        for product_id, quantity in plan.increments.items():
+            self.set_quantity(products[product_id], self.quantities.get(product_id, 0) + quantity)
+
+    @cached_property
+    def items(self):
+        # unsaved CartItems with their products and first images, in 2 queries
+        products = (
+            Product.objects
+            .defer('search_vector', 'description')
+            .prefetch_related(Prefetch('images', queryset=ProductImage.objects.order_by('id')))
+            .in_bulk(self.quantities)
+        )
+        return GuestItems(
+            CartItem(product=products[product_id], quantity=quantity)
+            for product_id, quantity in self.quantities.items()
+            if product_id in products # deleted since it was added
+        )
+
+
+def merge_guest_cart(user, token):
+    """
+    Move a guest cart into the user's database cart: quantities are added to the ones
+    already there, capped at the stock, in a single upsert.
+
+    Deleting the cache entry is the claim, so when login and a request carrying the same
+    cookie race, only one of them merges it.
+    """
+    key = guest_cart_key(token)
+    quantities = cache.get(key)
+    if not cache.delete(key) or not quantities:
+        return False
+    CartItem.objects.upsert_quantities(active_cart_id(user, create=True), quantities)
+    return True
@@ -0,0 +1,78 @@
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from cart.resolver import active_cart_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete checked out carts and long abandoned active carts with their items, "
+        "in small batches that skip carts in use"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-days', type=int, default=30, help="Keep checked out carts this long after checkout")
+        parser.add_argument('--abandoned-days', type=int, default=90, help="Active carts untouched this long are abandoned")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Count the carts without deleting them")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # checked out carts are copied into their orders, abandoned ones were never bought.
+        # Both go by updated_at: a checkout or an item write, not when the cart was created
+        stale = (
+            Q(is_active=False, updated_at__lt=now - timedelta(days=options['inactive_days']))
+            | Q(is_active=True, updated_at__lt=now - timedelta(days=options['abandoned_days']))
+        )
+        batch_size = options['batch_size']
+        start = time.monotonic()
+        deleted = 0
+        last_id = 0
+
+        while True:
+            # keyset iteration: each batch starts after the last id seen, never with an OFFSET
+            ids = list(
+                Cart.objects.filter(stale, id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            if options['dry_run']:
+                deleted += len(ids)
+                continue
+            deleted += self.delete_batch(ids, stale)
+            self.stdout.write(f"{deleted} carts deleted")
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} carts in {time.monotonic() - start:.1f}s"))
+
+    @transaction.atomic
+    def delete_batch(self, ids, stale):
+        # Carts being written to are skipped (adding an item locks its cart row), the condition
+        # is checked again under the lock, a cart may have been checked out since it was listed
+        carts = list(
+            Cart.objects.filter(stale, id__in=ids)
+            .select_for_update(skip_locked=True)
+            .values_list('id', 'user_id', 'is_active')
+        )
+        if not carts:
+            return 0
+        cart_ids = [cart_id for cart_id, user_id, is_active in carts]
+
+        CartItem.objects.filter(cart_id__in=cart_ids).delete()
+        # one statement for the carts too, not a post_delete signal per cart
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {Cart._meta.db_table} WHERE id = ANY(%s)", [cart_ids])
+
+        # the resolver may still hold the ids of the abandoned active carts
+        keys = [active_cart_key(user_id) for cart_id, user_id, is_active in carts if is_active]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+        return len(carts)
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+# Existing duplicates are merged into the oldest row before the constraint is added
+MERGE_DUPLICATE_ITEMS = """
+UPDATE cart_cartitem AS item SET quantity = duplicate.quantity
+FROM (
+    SELECT MIN(id) AS id, SUM(quantity) AS quantity
+    FROM cart_cartitem
+    GROUP BY cart_id, product_id
+    HAVING COUNT(*) > 1
+) AS duplicate
+WHERE item.id = duplicate.id;
+
+DELETE FROM cart_cartitem AS item
+USING cart_cartitem AS kept
+WHERE item.cart_id = kept.cart_id AND item.product_id = kept.product_id AND item.id > kept.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0005_cart_coupon'),
+        ('products', '0011_related_products'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_ITEMS, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
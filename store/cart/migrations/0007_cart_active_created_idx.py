@@ -0,0 +1,20 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0006_unique_cart_product'),
+        ('coupons', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['created_at'], name='cart_active_created_idx'),
+        ),
+    ]
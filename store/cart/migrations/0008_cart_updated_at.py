@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Existing carts get their creation time, the best known last activity. Without it every
+# cart would look freshly used and prune_carts would keep them all another full period
+BACKFILL_UPDATED_AT = "UPDATE cart_cart SET updated_at = created_at"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0007_cart_active_created_idx'),
+        ('coupons', '0004_promotion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cart',
+            name='cart_active_created_idx',
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunSQL(BACKFILL_UPDATED_AT, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['is_active', 'updated_at'], name='cart_active_updated_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import connection, models
 from django.contrib.auth.models import User
+from django.db.models.functions import Least, Now
 from products.models import Product
 
 # Create your models here.
@@ -8,16 +9,13 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True) # Indicates if the cart is active or has been checked out
     coupon = models.ForeignKey('coupons.Coupon', on_delete=models.SET_NULL, null=True, blank=True)
+    # last write to the cart or its items (see touch_cart), what prune_carts ages carts by
+    updated_at = models.DateTimeField(auto_now=True)
 
     @property
     def total_price(self):
-        items_total = sum(item.total_price for item in self.items.all())
-        if self.coupon and self.coupon.is_valid:
-            if self.coupon.discount_type == 'percentage':
-                return items_total * (100 - self.coupon.discount) / 100
-            else:
-                return max(items_total - self.coupon.discount, 0)
-        return items_total
+        from .pricing import price_cart # pricing imports the models
+        return price_cart(self).total
     
     def __str__(self):
         return f"Cart {self.id} - {self.user.username}"
@@ -31,13 +29,74 @@ class Cart(models.Model):
                 name='unique_active_cart_per_user'# constraint name
             )
         ]
+        indexes = [
+            # prune_carts: checked out and abandoned carts by their last activity
+            models.Index(fields=['is_active', 'updated_at'], name='cart_active_updated_idx'),
+        ]
     
+class CartItemQuerySet(models.QuerySet):
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Add `quantity` of a product to a cart in one statement, capped at the product's stock.
+
+        Concurrent adds of the same product both land: the row is inserted or its quantity
+        incremented by the database, never read and written back from Python.
+        Returns the new quantity, or None when nothing was written (inactive cart,
+        unknown or out of stock product).
+        """
+        return self.upsert_quantities(cart_id, {product_id: quantity}).get(product_id)
+
+    def upsert_quantities(self, cart_id, quantities, increment=True):
+        # {product_id: quantity} added to (or with increment=False, replacing) the cart's
+        # quantities in one statement, returns {product_id: new quantity} for the rows written
+        if not quantities:
+            return {}
+        item_table = self.model._meta.db_table
+        product_table = Product._meta.db_table
+        quantity = f"{item_table}.quantity + EXCLUDED.quantity" if increment else "EXCLUDED.quantity"
+        with connection.cursor() as cursor:
+            # the CTE touches the cart (see touch_cart) and yields it only while it is active
+            cursor.execute(
+                f"""
+                WITH cart AS (
+                    UPDATE {Cart._meta.db_table} SET updated_at = now()
+                    WHERE id = %s AND is_active
+                    RETURNING id
+                )
+                INSERT INTO {item_table} (cart_id, product_id, quantity)
+                SELECT cart.id, product.id, LEAST(line.quantity, product.stock)
+                FROM unnest(%s::integer[], %s::integer[]) AS line(product_id, quantity)
+                JOIN {product_table} AS product ON product.id = line.product_id
+                CROSS JOIN cart
+                WHERE product.stock > 0
+                ON CONFLICT (cart_id, product_id) DO UPDATE
+                SET quantity = LEAST(
+                    {quantity},
+                    (SELECT stock FROM {product_table} WHERE id = EXCLUDED.product_id)
+                )
+                RETURNING product_id, quantity
+                """,
+                [cart_id, list(quantities), list(quantities.values())],
+            )
+            return dict(cursor.fetchall())
+
+    def set_quantity(self, quantity):
+        # Set the quantity of the selected items in one UPDATE, capped at the products' stock
+        stock = Product.objects.filter(pk=models.OuterRef('product_id')).values('stock')
+        return self.update(quantity=Least(models.Value(quantity), models.Subquery(stock)))
+
+def touch_cart(cart_id):
+    # Item writes done with update()/delete() bypass Cart.save, they mark the cart used here
+    Cart.objects.filter(pk=cart_id).update(updated_at=Now())
+
 # the items in the cart
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
     
@@ -49,4 +108,10 @@ class CartItem(models.Model):
 
     @property
     def total_price(self):
-        return self.product.final_price * self.quantity
\ No newline at end of file
+        return self.product.final_price * self.quantity
+
+    class Meta:
+        constraints = [
+            # one row per product, adding it again increments the quantity (see add_quantity)
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product')
+        ]
@@ -0,0 +1,62 @@
+from django.db.models import Prefetch
+from coupons.promotions import Line, price_lines
+from products.models import ProductImage
+from .models import Cart, CartItem
+
+def cart_queryset():
+    # The cart with everything pricing and the cart serializers read, in 3 queries:
+    # cart + coupon, items + products, then the products' images
+    items = (
+        CartItem.objects
+        .select_related('product')
+        .defer('product__search_vector', 'product__description')
+        .prefetch_related(Prefetch('product__images', queryset=ProductImage.objects.order_by('id')))
+        .order_by('id')
+    )
+    return Cart.objects.select_related('coupon').prefetch_related(Prefetch('items', queryset=items))
+
+def load_cart(**lookup):
+    # e.g. load_cart(pk=cart.pk), raises Cart.DoesNotExist like get()
+    return cart_queryset().get(**lookup)
+
+class EmptyCart:
+    # Stand-in for users without an active cart, serialized and priced without any query
+    id = pk = None
+    is_active = True
+    created_at = None
+    coupon = coupon_id = None
+
+    def __init__(self, user):
+        self.user = user
+        self.items = CartItem.objects.none()
+
+
+class CartPricing:
+    """
+    Subtotal, promotions, coupon discount and total of a cart, computed in one pass over
+    its items (see coupons.promotions.price_lines).
+
+    Reads cart.items.all() and cart.coupon, so a cart from load_cart() is priced
+    without any query.
+    """
+
+    def __init__(self, cart):
+        self.cart = cart
+        self.items = list(cart.items.all())
+        lines = [
+            Line(item.product.category_id, item.product.brand_id, item.product.final_price, item.quantity)
+            for item in self.items
+        ]
+
+        coupon = cart.coupon
+        self.coupon_valid = coupon is not None and coupon.is_valid # checked once, is_valid reads the clock
+        price = price_lines(lines, coupon if self.coupon_valid else None)
+        self.subtotal = price.subtotal
+        self.promotions = price.promotions
+        self.promotion_discount = price.promotion_discount
+        self.coupon_discount = price.coupon_discount
+        self.discount = price.discount
+        self.total = price.total
+
+def price_cart(cart):
+    return CartPricing(cart)
@@ -0,0 +1,31 @@
+from django.core.cache import cache
+from .models import Cart
+
+ACTIVE_CART_TTL = 60 * 60 * 24
+NO_CART = 0 # cached for users without an active cart, so they are not looked up again
+
+def active_cart_key(user_id):
+    return f'cart:active:{user_id}'
+
+def active_cart_id(user, create=False):
+    """
+    Id of the user's active cart from the shared cache, the database is only read on a miss.
+
+    Returns None when the user has no active cart, unless `create` is set: carts are
+    created by the first write, never by reads.
+    """
+    key = active_cart_key(user.id)
+    cart_id = cache.get(key)
+    if cart_id is None:
+        cart_id = Cart.objects.filter(user=user, is_active=True).values_list('id', flat=True).first() or NO_CART
+        cache.set(key, cart_id, ACTIVE_CART_TTL)
+
+    if cart_id == NO_CART and create:
+        cart, created = Cart.objects.get_or_create(user=user, is_active=True)
+        cart_id = cart.id
+        cache.set(key, cart_id, ACTIVE_CART_TTL)
+    return cart_id or None
+
+def forget_active_cart(user_id):
+    # Called whenever a cart is activated/deactivated (see cart/signals.py)
+    cache.delete(active_cart_key(user_id))
@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from products.images import thumbnail_url, srcset
+from products.serializers import first_image
+from .pricing import price_cart
 from .models import Cart, CartItem
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -6,15 +9,23 @@ class CartItemSerializer(serializers.ModelSerializer):
     product_price = serializers.ReadOnlyField(source='product.final_price')
     total_price = serializers.SerializerMethodField()
     product_image = serializers.SerializerMethodField()
+    product_image_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'product_name', 'product_price', 'quantity', 'total_price', 'product_image']
+        fields = ['id', 'product', 'product_name', 'product_price', 'quantity', 'total_price', 'product_image', 'product_image_srcset']
 
+    # thumbnail sized image, the item rows never need the original
     def get_product_image(self, obj):
-        image = obj.product.images.first()
+        image = first_image(obj.product) # prefetched by load_cart
         if image:
-            return image.image.url
+            return thumbnail_url(image)
+        return None
+
+    def get_product_image_srcset(self, obj):
+        image = first_image(obj.product)
+        if image:
+            return srcset(image)
         return None
 
     def get_total_price(self, obj):
@@ -28,19 +39,22 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
     coupon = CouponSerializer(read_only=True)
     discount = serializers.SerializerMethodField()
+    promotions = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'is_active', 'created_at', 'items', 'total_price', 'coupon', 'discount']
+        fields = ['id', 'user', 'is_active', 'created_at', 'items', 'total_price', 'coupon', 'discount', 'promotions']
+
+    def to_representation(self, obj):
+        # priced once, total_price and discount read the same result
+        self.pricing = price_cart(obj)
+        return super().to_representation(obj)
 
     def get_total_price(self, obj):
-        return obj.total_price
+        return self.pricing.total
 
     def get_discount(self, obj):
-        if obj.coupon and obj.coupon.is_valid:
-            items_total = sum(item.total_price for item in obj.items.all())
-            if obj.coupon.discount_type == 'percentage':
-                return items_total * obj.coupon.discount / 100
-            else:
-                return min(obj.coupon.discount, items_total)
-        return 0
+        return self.pricing.discount
+
+    def get_promotions(self, obj):
+        return [promotion._asdict() for promotion in self.pricing.promotions]
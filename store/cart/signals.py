@@ -0,0 +1,24 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Cart
+from .resolver import forget_active_cart
+from .guest import read_guest_token, merge_guest_cart
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def cart_changed(sender, instance, **kwargs):
+    # Drop the cached active cart id once the change is visible to other requests:
+    # deleted earlier, a concurrent request could cache the old id again
+    user_id = instance.user_id
+    transaction.on_commit(lambda: forget_active_cart(user_id))
+
+
+@receiver(user_logged_in)
+def merge_guest_cart_on_login(sender, request, user, **kwargs):
+    # The cart built before logging in joins the user's cart, the cookie is dropped
+    # by the next cart request
+    token = read_guest_token(request) if request is not None else None
+    if token:
+        merge_guest_cart(user, token)
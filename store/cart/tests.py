@@ -0,0 +1,320 @@
+from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from io import StringIO
+from django.utils import timezone
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from products.models import Product, Category, Brand, ProductImage
+from django.contrib import admin
+from cart.admin import CartAdmin
+from cart.models import Cart, CartItem
+from cart.guest import GUEST_CART_COOKIE
+from allauth.account.models import EmailAddress
+from coupons.models import Coupon
+from decimal import Decimal
+import datetime
+
+class CartPricingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Bags')
+        self.brand = Brand.objects.create(name='Moda')
+        self.cart = Cart.objects.create(user=self.user)
+        self.coupon = Coupon.objects.create(
+            code='PCT10',
+            discount=Decimal('10.00'),
+            discount_type='percentage',
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1)
+        )
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'Bag {i}', price=Decimal('100.00'), discount=20, category=self.category, brand=self.brand, stock=10
+            )
+            ProductImage.objects.create(product=product, image=f'products/bag-{i}.jpg')
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def test_cart_loaded_in_constant_queries(self):
+        self.add_products(2)
+        self.client.get('/api/cart/') # caches the active cart id
+        with self.assertNumQueries(3):
+            self.client.get('/api/cart/')
+
+        self.add_products(18)
+        self.cart.coupon = self.coupon
+        self.cart.save()
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/')
+
+        # 20 items x 2 x 80.00 = 3200, 10% off
+        self.assertEqual(len(response.data['items']), 20)
+        self.assertEqual(response.data['discount'], Decimal('320.00'))
+        self.assertEqual(response.data['total_price'], Decimal('2880.00'))
+
+    def test_admin_total_matches_the_cart(self):
+        self.add_products(2)
+        self.cart.coupon = self.coupon
+        self.cart.save()
+        model_admin = CartAdmin(Cart, admin.site)
+        cart = model_admin.get_queryset(None).get(pk=self.cart.pk)
+        self.assertEqual(model_admin.total_price(cart), Decimal('288.00'))
+        self.assertEqual(Cart.objects.get().total_price, Decimal('288.00'))
+
+    def test_fixed_coupon_checked_against_subtotal(self):
+        self.add_products(1)
+        Coupon.objects.create(
+            code='FIXED200',
+            discount=Decimal('200.00'),
+            discount_type='fixed',
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1)
+        )
+        response = self.client.post('/api/cart/apply_coupon/', {'code': 'fixed200'})
+        self.assertEqual(response.status_code, 400) # 160.00 in the cart
+
+        response = self.client.post('/api/cart/apply_coupon/', {'code': 'pct10'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_price'], Decimal('144.00'))
+
+
+class CartItemUpsertTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(
+            name='Bag', price=Decimal('100.00'), category=Category.objects.create(name='Bags'),
+            brand=Brand.objects.create(name='Moda'), stock=5
+        )
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_add_increments_in_one_row_capped_at_stock(self):
+        self.assertEqual(CartItem.objects.add_quantity(self.cart.id, self.product.id, 2), 2)
+        self.assertEqual(CartItem.objects.add_quantity(self.cart.id, self.product.id, 2), 4)
+        self.assertEqual(CartItem.objects.add_quantity(self.cart.id, self.product.id, 2), 5)
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+    def test_add_skips_inactive_cart(self):
+        Cart.objects.filter(pk=self.cart.pk).update(is_active=False)
+        self.assertIsNone(CartItem.objects.add_quantity(self.cart.id, self.product.id, 1))
+
+    def test_item_endpoints(self):
+        response = self.client.post('/api/cart/add_item/', {'product': self.product.id, 'quantity': 3})
+        self.assertEqual(response.data['items'][0]['quantity'], 3)
+
+        response = self.client.post('/api/cart/update_quantity/', {'product': self.product.id, 'quantity': 9})
+        self.assertEqual(response.data['items'][0]['quantity'], 5)
+
+        response = self.client.post('/api/cart/add_item/', {'product': 999999})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post('/api/cart/remove_item/', {'product': self.product.id})
+        self.assertEqual(response.data['items'], [])
+        response = self.client.post('/api/cart/remove_item/', {'product': self.product.id})
+        self.assertEqual(response.status_code, 404)
+
+
+class CartBatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Bags')
+        brand = Brand.objects.create(name='Moda')
+        self.bag, self.belt, self.hat = [
+            Product.objects.create(name=name, price=Decimal('50.00'), category=category, brand=brand, stock=5)
+            for name in ('Bag', 'Belt', 'Hat')
+        ]
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.hat, quantity=1)
+        Coupon.objects.create(
+            code='PCT10',
+            discount=Decimal('10.00'),
+            discount_type='percentage',
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1)
+        )
+
+    def batch(self, *operations):
+        return self.client.post('/api/cart/batch/', {'operations': operations}, format='json')
+
+    def test_operations_applied_in_order(self):
+        response = self.batch(
+            {'op': 'add', 'product': self.bag.id, 'quantity': 2},
+            {'op': 'add', 'product': self.bag.id},
+            {'op': 'add', 'product': self.belt.id, 'quantity': 4},
+            {'op': 'update', 'product': self.belt.id, 'quantity': 1},
+            {'op': 'add', 'product': self.belt.id},
+            {'op': 'remove', 'product': self.hat.id},
+            {'op': 'apply_coupon', 'code': 'pct10'},
+        )
+        self.assertEqual(response.status_code, 200)
+        quantities = {item['product_name']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {'Bag': 3, 'Belt': 2})
+        self.assertEqual(response.data['coupon']['code'], 'PCT10')
+        self.assertEqual(response.data['total_price'], Decimal('225.00'))
+
+    def test_failed_operation_applies_nothing(self):
+        response = self.batch(
+            {'op': 'add', 'product': self.bag.id},
+            {'op': 'add', 'product': 999999},
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['operation'], 1)
+
+        response = self.batch(
+            {'op': 'remove', 'product': self.hat.id},
+            {'op': 'apply_coupon', 'code': 'NOPE'},
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(list(CartItem.objects.values_list('product__name', flat=True)), ['Hat'])
+
+
+class ActiveCartResolverTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(
+            name='Bag', price=Decimal('100.00'), category=Category.objects.create(name='Bags'),
+            brand=Brand.objects.create(name='Moda'), stock=5
+        )
+
+    def test_reads_never_create_a_cart(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.data['items'], [])
+        self.assertEqual(response.data['total_price'], 0)
+
+        # the missing cart is cached too
+        with self.assertNumQueries(0):
+            self.client.get('/api/cart/')
+        self.assertFalse(Cart.objects.exists())
+
+    def test_first_write_creates_the_cart_and_checkout_releases_it(self):
+        self.client.get('/api/cart/')
+        response = self.client.post('/api/cart/add_item/', {'product': self.product.id})
+        cart = Cart.objects.get()
+        self.assertEqual(response.data['id'], cart.id)
+
+        with self.assertNumQueries(3): # cart, items and images, no lookup of the cart id
+            self.client.get('/api/cart/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/cart/checkout/', {'phone': '0100', 'address': 'Cairo'})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/api/cart/')
+        self.assertIsNone(response.data['id'])
+        self.assertEqual(Cart.objects.filter(is_active=True).count(), 0)
+
+
+class GuestCartTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='Bags')
+        brand = Brand.objects.create(name='Moda')
+        self.bag, self.belt = [
+            Product.objects.create(name=name, price=Decimal('50.00'), category=category, brand=brand, stock=3)
+            for name in ('Bag', 'Belt')
+        ]
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        EmailAddress.objects.create(user=self.user, email=self.user.email, verified=True, primary=True)
+
+    def test_guest_cart_lives_outside_the_database(self):
+        response = self.client.post('/api/cart/add_item/', {'product': self.bag.id, 'quantity': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(GUEST_CART_COOKIE, response.cookies)
+        self.client.post('/api/cart/add_item/', {'product': self.bag.id, 'quantity': 2})
+
+        response = self.client.get('/api/cart/')
+        self.assertEqual([(item['product_name'], item['quantity']) for item in response.data['items']], [('Bag', 3)])
+        self.assertEqual(response.data['total_price'], Decimal('150.00'))
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.post('/api/cart/checkout/', {'phone': '0100', 'address': 'Cairo'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_guest_update_rejects_bad_input_and_deleted_products(self):
+        self.client.post('/api/cart/add_item/', {'product': self.bag.id})
+        response = self.client.post('/api/cart/update_quantity/', {'product': self.bag.id, 'quantity': 'two'})
+        self.assertEqual(response.status_code, 400)
+
+        bag_id = self.bag.id
+        self.bag.delete()
+        response = self.client.post('/api/cart/update_quantity/', {'product': bag_id, 'quantity': 2})
+        self.assertEqual(response.status_code, 404)
+
+    def test_guest_cart_merged_once_on_login(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.belt, quantity=1)
+        self.client.post('/api/cart/add_item/', {'product': self.bag.id})
+        self.client.post('/api/cart/add_item/', {'product': self.belt.id})
+
+        response = self.client.post('/api/auth/login/', {'email': self.user.email, 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['key']}")
+
+        # the cookie is still sent once, the cart must not be merged twice
+        response = self.client.get('/api/cart/')
+        quantities = {item['product_name']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {'Bag': 1, 'Belt': 2})
+        self.assertEqual(response.cookies[GUEST_CART_COOKIE].value, '')
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies[GUEST_CART_COOKIE] = 'forged'
+        response = self.client.get('/api/cart/')
+        self.assertEqual(response.data['items'], [])
+
+
+class PruneCartsTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Bag', price=Decimal('100.00'), category=Category.objects.create(name='Bags'),
+            brand=Brand.objects.create(name='Moda'), stock=5
+        )
+
+    def cart(self, username, days, is_active):
+        user = User.objects.create_user(username=username, password='password')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        Cart.objects.filter(pk=cart.pk).update(
+            is_active=is_active, updated_at=timezone.now() - datetime.timedelta(days=days)
+        )
+        return cart
+
+    def test_prunes_old_carts_in_batches(self):
+        self.cart('checked_out', 40, False)
+        self.cart('abandoned', 100, True)
+        recent = self.cart('recent', 5, False)
+        live = self.cart('live', 10, True)
+
+        call_command('prune_carts', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {recent.id, live.id})
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_old_carts_still_in_use_are_kept(self):
+        old = timezone.now() - datetime.timedelta(days=200)
+        live = self.cart('live', 100, True)
+        checked_out = self.cart('checked_out', 40, True)
+        Cart.objects.filter(pk__in=[live.pk, checked_out.pk]).update(created_at=old)
+
+        # adding an item and checking out count as activity, however old the cart is
+        CartItem.objects.add_quantity(live.id, self.product.id, 1)
+        checked_out.refresh_from_db()
+        checked_out.is_active = False
+        checked_out.save(update_fields=['is_active', 'updated_at'])
+
+        call_command('prune_carts', stdout=StringIO())
+        self.assertEqual(Cart.objects.count(), 2)
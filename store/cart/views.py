@@ -1,72 +1,159 @@
 from django.db import transaction
-from django.db.models import F
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import Cart, CartItem
+from .models import Cart, CartItem, touch_cart
 from products.models import Product
 from .serializers import CartSerializer
+from .pricing import load_cart, price_cart, EmptyCart
+from .resolver import active_cart_id, forget_active_cart
+from .batch import MAX_OPERATIONS, BatchPlan, OperationError
+from .guest import GUEST_CART_COOKIE, GUEST_CART_TTL, GuestCart, read_guest_token, merge_guest_cart
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from rest_framework.permissions import IsAuthenticated
-from orders.models import Order, OrderItem
-from coupons.models import Coupon
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from orders.checkout import place_order, CheckoutError
+from coupons.lookup import get_coupon
 
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
-    def get_active_cart(self, user):
-        cart, created = Cart.objects.get_or_create(user=user, is_active=True)
-        return cart
+    def get_permissions(self):
+        # guests can build a cart (see cart/guest.py), coupons and checkout need an account
+        if self.action in ('apply_coupon', 'remove_coupon', 'checkout'):
+            return [IsAuthenticated()]
+        return [AllowAny()]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.guest_token = read_guest_token(request)
+        self.guest_cart = None
+        # normally merged by the login view (see cart/signals.py), this covers tokens
+        # obtained some other way; a no-op when the cart was merged already
+        if request.user.is_authenticated and self.guest_token:
+            merge_guest_cart(request.user, self.guest_token)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        guest_cart = getattr(self, 'guest_cart', None)
+        if guest_cart is not None and guest_cart.saved:
+            response.set_cookie(GUEST_CART_COOKIE, guest_cart.cookie, max_age=GUEST_CART_TTL, httponly=True, samesite='Lax')
+        elif getattr(self, 'guest_token', None) and request.user.is_authenticated:
+            response.delete_cookie(GUEST_CART_COOKIE, samesite='Lax')
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_guest_cart(self):
+        self.guest_cart = GuestCart(self.guest_token)
+        return self.guest_cart
+
+    def guest_response(self, cart):
+        cart.save()
+        return Response(CartSerializer(cart).data, status=200)
+
+    def get_priced_cart(self, user, create=False):
+        # the active cart loaded with its coupon, items, products and images in 3 queries,
+        # an empty stand-in (no query at all) when the user has none and create isn't set
+        cart_id = active_cart_id(user, create=create)
+        if cart_id:
+            try:
+                return load_cart(pk=cart_id, is_active=True)
+            except Cart.DoesNotExist:
+                # stale cached id, resolve it again from the database
+                forget_active_cart(user.id)
+                cart_id = active_cart_id(user, create=create)
+                if cart_id:
+                    return load_cart(pk=cart_id)
+        return EmptyCart(user)
+
+    def cart_response(self, cart_id):
+        # reloaded after a write, the items may have changed
+        return Response(CartSerializer(load_cart(pk=cart_id)).data, status=200)
 
     def list(self, request):
-        cart = self.get_active_cart(request.user)
+        if not request.user.is_authenticated:
+            return Response(CartSerializer(self.get_guest_cart()).data)
+        cart = self.get_priced_cart(request.user)
         serializer = CartSerializer(cart)
         return Response(serializer.data)
 
     @action(detail=False, methods=['post'])
     def add_item(self, request):
-        cart = self.get_active_cart(request.user)
-        if not cart.is_active:
-            return Response({"error": "Cannot add items to inactive cart"}, status=400)
-
-        product_id = request.data.get('product')
-        quantity = int(request.data.get('quantity', 1))
-        product = get_object_or_404(Product, id=product_id)
+        try:
+            product_id = int(request.data.get('product'))
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response({"error": "product and quantity must be integers"}, status=400)
+        if quantity <= 0:
+            return Response({"error": "Quantity must be positive"}, status=400)
 
-        if not product.in_stock:
-            return Response({"error": "Product out of stock"}, status=400)
+        if not request.user.is_authenticated:
+            cart = self.get_guest_cart()
+            product = get_object_or_404(Product.objects.only('id', 'stock'), id=product_id)
+            if not product.in_stock:
+                return Response({"error": "Product out of stock"}, status=400)
+            cart.set_quantity(product, cart.quantities.get(product.id, 0) + quantity)
+            return self.guest_response(cart)
 
-        # Update quantity if item exists
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        if not created:
-            cart_item.quantity += quantity
-        else:
-            cart_item.quantity = quantity
-        cart_item.save()
+        cart_id = active_cart_id(request.user, create=True) # the first item creates the cart
+        # Insert the item or increment its quantity in one statement, capped at the stock
+        if CartItem.objects.add_quantity(cart_id, product_id, quantity) is None:
+            # nothing written, only this path pays for working out why
+            product = get_object_or_404(Product, id=product_id)
+            if not product.in_stock:
+                return Response({"error": "Product out of stock"}, status=400)
+            forget_active_cart(request.user.id) # the cached cart was deactivated, the next try resolves it again
+            return Response({"error": "Cannot add items to inactive cart"}, status=400)
 
-        return Response(CartSerializer(cart).data, status=200)
+        return self.cart_response(cart_id)
 
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
-        cart = self.get_active_cart(request.user)
+        if not request.user.is_authenticated:
+            cart = self.get_guest_cart()
+            if cart.quantities.pop(self.guest_product_id(request), None) is None:
+                raise Http404("No CartItem matches the given query.")
+            return self.guest_response(cart)
+
+        cart_id = active_cart_id(request.user)
+        if cart_id is None:
+            raise Http404("No CartItem matches the given query.")
         product_id = request.data.get('product')
-        item = get_object_or_404(CartItem, cart=cart, product_id=product_id)
-        item.delete()
-        return Response(CartSerializer(cart).data, status=200)
+        deleted, _ = CartItem.objects.filter(cart_id=cart_id, product_id=product_id).delete()
+        if not deleted:
+            raise Http404("No CartItem matches the given query.")
+        touch_cart(cart_id)
+        return self.cart_response(cart_id)
 
     @action(detail=False, methods=['post'])
     def update_quantity(self, request):
-        cart = self.get_active_cart(request.user)
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response({"error": "quantity must be an integer"}, status=400)
+
+        if not request.user.is_authenticated:
+            cart = self.get_guest_cart()
+            product_id = self.guest_product_id(request)
+            if product_id not in cart.quantities:
+                raise Http404("No CartItem matches the given query.")
+            # the product may have been deleted since it was added
+            cart.set_quantity(get_object_or_404(Product.objects.only('id', 'stock'), id=product_id), quantity)
+            return self.guest_response(cart)
+
+        cart_id = active_cart_id(request.user)
+        if cart_id is None:
+            raise Http404("No CartItem matches the given query.")
         product_id = request.data.get('product')
-        quantity = int(request.data.get('quantity', 1))
-        item = get_object_or_404(CartItem, cart=cart, product_id=product_id)
+        items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
 
+        # a single DELETE/UPDATE, no read of the item first
         if quantity <= 0:
-            item.delete()
+            changed, _ = items.delete()
         else:
-            item.quantity = quantity
-            item.save()
-        return Response(CartSerializer(cart).data, status=200)
+            changed = items.set_quantity(quantity)
+        if not changed:
+            raise Http404("No CartItem matches the given query.")
+        touch_cart(cart_id)
+        return self.cart_response(cart_id)
 
     @action(detail=False, methods=['post'])
     def apply_coupon(self, request):
@@ -74,42 +161,115 @@ class CartViewSet(viewsets.ViewSet):
         if not code:
             return Response({"error": "Coupon code is required"}, status=400)
         
-        try:
-            coupon = Coupon.objects.get(code__iexact=code)
-        except Coupon.DoesNotExist:
+        coupon = get_coupon(code)
+        if coupon is None:
             return Response({"error": "Invalid coupon code"}, status=404)
         
         if not coupon.is_valid:
             return Response({"error": "Coupon is expired or invalid"}, status=400)
         
-        cart = self.get_active_cart(request.user)
+        cart = self.get_priced_cart(request.user, create=True)
         
         if cart.coupon:
             return Response({"error": "Cart already has a coupon applied"}, status=400)
 
         if coupon.discount_type == "fixed":
-            if coupon.discount >= cart.total_price:
+            pricing = price_cart(cart)
+            if coupon.discount >= pricing.subtotal - pricing.promotion_discount:
                 return Response({"error":"Can't add this coupon to this cart"}, status=400) 
         
         cart.coupon = coupon
-        cart.save()
+        cart.save(update_fields=['coupon', 'updated_at'])
         
         return Response(CartSerializer(cart).data, status=200)
 
     @action(detail=False, methods=['post'])
     def remove_coupon(self, request):
-        cart = self.get_active_cart(request.user)
-        cart.coupon = None
-        cart.save()
+        cart = self.get_priced_cart(request.user)
+        if cart.coupon_id:
+            cart.coupon = None
+            cart.save(update_fields=['coupon', 'updated_at'])
         return Response(CartSerializer(cart).data, status=200)
 
     @action(detail=False, methods=['post'])
-    def checkout(self, request):
-        cart = self.get_active_cart(request.user)
+    def batch(self, request):
+        """
+        Apply an ordered list of operations (see BatchPlan) in one transaction and return
+        the cart once. Either every operation is applied or none is.
+        """
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({"error": "operations must be a non-empty list"}, status=400)
+        if len(operations) > MAX_OPERATIONS:
+            return Response({"error": f"At most {MAX_OPERATIONS} operations per batch"}, status=400)
 
-        if cart.items.count() == 0:
-            return Response({"error": "Cart is empty"}, status=400)
+        if not request.user.is_authenticated:
+            cart = self.get_guest_cart()
+            try:
+                plan = BatchPlan(operations, None)
+                if plan.coupon_changed:
+                    raise OperationError(plan.coupon_index, "Log in to use coupons", status=401)
+                products, coupon = self.check_batch(plan)
+            except OperationError as e:
+                return Response({"error": e.message, "operation": e.index}, status=e.status)
+            cart.apply(plan, products)
+            return self.guest_response(cart)
+
+        cart = Cart.objects.only('id', 'coupon_id').get(pk=active_cart_id(request.user, create=True))
+        try:
+            plan = BatchPlan(operations, cart.coupon_id)
+            products, coupon = self.check_batch(plan)
+        except OperationError as e:
+            return Response({"error": e.message, "operation": e.index}, status=e.status)
+
+        with transaction.atomic():
+            # one statement per kind of write, whatever the number of operations
+            if plan.removed:
+                CartItem.objects.filter(cart=cart, product_id__in=plan.removed).delete()
+                touch_cart(cart.id) # the upserts below touch it too, if they write anything
+            CartItem.objects.upsert_quantities(cart.id, plan.updated, increment=False)
+            CartItem.objects.upsert_quantities(cart.id, plan.increments)
+
+            cart = load_cart(pk=cart.pk)
+            if plan.coupon_changed:
+                pricing = price_cart(cart)
+                # fixed coupons must leave something to pay after the promotions
+                if coupon and coupon.discount_type == "fixed" and coupon.discount >= pricing.subtotal - pricing.promotion_discount:
+                    transaction.set_rollback(True)
+                    return Response({"error": "Can't add this coupon to this cart", "operation": plan.coupon_index}, status=400)
+                cart.coupon = coupon
+                cart.save(update_fields=['coupon', 'updated_at'])
+
+        return Response(CartSerializer(cart).data, status=200)
+
+    def check_batch(self, plan):
+        # Same checks as the single item/coupon endpoints, one query for all the products.
+        # Returns the products (id and stock) and the coupon to apply
+        products = Product.objects.filter(id__in=plan.indexes.keys()).only('id', 'stock').in_bulk()
+        for product_id, index in plan.indexes.items():
+            if product_id not in products:
+                raise OperationError(index, "Product not found", status=404)
+            if product_id in plan.added and not products[product_id].in_stock:
+                raise OperationError(index, "Product out of stock")
+
+        if not plan.coupon_code:
+            return products, None
+        coupon = get_coupon(plan.coupon_code)
+        if coupon is None:
+            raise OperationError(plan.coupon_index, "Invalid coupon code", status=404)
+        if not coupon.is_valid:
+            raise OperationError(plan.coupon_index, "Coupon is expired or invalid")
+        return products, coupon
+
+    def guest_product_id(self, request):
+        # guest carts are keyed by int ids, anything else isn't in the cart
+        try:
+            return int(request.data.get('product'))
+        except (TypeError, ValueError):
+            raise Http404("No CartItem matches the given query.")
 
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
         phone = request.data.get('phone')
         address = request.data.get('address')
         payment_method = request.data.get('payment_method', 'online')
@@ -117,58 +277,19 @@ class CartViewSet(viewsets.ViewSet):
         if not phone or not address:
             return Response({"error": "Phone and address required"}, status=400)
 
-        # Calculate discount amount for storage
-        discount_amount = 0
-        if cart.coupon and cart.coupon.is_valid:
-            items_total = sum(item.total_price for item in cart.items.all())
-            if cart.coupon.discount_type == 'percentage':
-                discount_amount = items_total * cart.coupon.discount / 100
-            else:
-                discount_amount = min(cart.coupon.discount, items_total)
-
-        # Creating an order for the user
-        order = Order.objects.create(
-            user=request.user,
-            total_price=cart.total_price,
-            coupon=cart.coupon,
-            discount_amount=discount_amount,
-            phone=phone,
-            address=address,
-            status='pending' if payment_method == 'online' else 'cod'
-        )
-
-        # Creating and order item for each item in the cart
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity if item.quantity <= item.product.stock else item.product.stock, # for safety
-                price=item.product.price
-            )
-
-        # If COD, deduct stock immediately
-        if order.status == 'cod':
-            with transaction.atomic():
-                for item in order.items.all():
-                    # Double check stock before final deduction
-                    if item.product.stock < item.quantity:
-                        return Response(
-                            {"error": f"Not enough stock for {item.product.name} only {item.product.stock} left"},
-                            status=409
-                    )
-                    item.product.stock = F('stock') - item.quantity
-                    item.product.save()
+        cart_id = active_cart_id(request.user)
+        if cart_id is None:
+            return Response({"error": "Cart is empty"}, status=400)
 
-        if cart.coupon:
-            cart.coupon.usage_count = F('usage_count') + 1
-            cart.coupon.save()
+        # one transaction: order, items, stock and coupon usage are all written or none is
+        try:
+            order = place_order(
+                request.user, cart_id, phone, address,
+                status='pending' if payment_method == 'online' else 'cod'
+            )
+        except CheckoutError as e:
+            return Response({"error": e.message}, status=e.status)
 
-        cart.is_active = False
-        cart.save()
-        
-        # Create a new active cart for the user
-        Cart.objects.create(user=request.user)
-        
         message = "Order created. Payment required." if order.status == 'pending' else "Order placed successfully"
         
         return Response({
@@ -1,9 +1,33 @@
 from django.contrib import admin
-from .models import Coupon
+from .models import Coupon, Promotion
+from .redemption import set_redemption_shards
+from store.paginator import EstimatedCountPaginator
 # Register your models here.
 
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
-    list_display = ('id', 'code', 'discount', 'discount_type', 'valid_from', 'valid_until', 'usage_limit')
+    list_display = ('id', 'code', 'discount', 'discount_type', 'valid_from', 'valid_until', 'usage_limit', 'redemption_shards')
     list_filter = ('discount_type',)
-    search_fields = ('code', 'id')
\ No newline at end of file
+    search_fields = ('code', 'id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ('redemption_shards',) # changed through the actions, which split the counters
+    actions = ['shard_redemptions', 'single_counter']
+
+    @admin.action(description="Spread redemptions over 16 counters (flash sales)")
+    def shard_redemptions(self, request, queryset):
+        for coupon in queryset:
+            set_redemption_shards(coupon, 16)
+
+    @admin.action(description="Use a single redemption counter")
+    def single_counter(self, request, queryset):
+        for coupon in queryset:
+            set_redemption_shards(coupon, 0)
+
+
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'kind', 'value', 'category', 'brand', 'min_subtotal', 'stackable', 'priority', 'active', 'valid_until')
+    list_filter = ('kind', 'active', 'stackable')
+    search_fields = ('name', 'id')
+    list_select_related = ('category', 'brand')
@@ -0,0 +1,34 @@
+from django.core.cache import cache
+from django.db.models.functions import Upper
+from .models import Coupon
+
+# Short: redemptions update usage_count without a save, a cached coupon may show a few
+# uses less for this long. Checkout enforces the limit itself (see coupons/redemption.py)
+COUPON_CACHE_TTL = 60
+NO_COUPON = 0 # cached for unknown codes too, guessing codes doesn't reach the database
+
+def normalize_code(code):
+    return str(code).strip().upper()
+
+def coupon_cache_key(code):
+    return f'coupon:code:{normalize_code(code)}'
+
+def get_coupon(code):
+    """
+    The coupon with this code, case insensitive, from the shared cache; None when there
+    is none. A miss is served by the UPPER(code) index.
+    """
+    key = coupon_cache_key(code)
+    coupon = cache.get(key)
+    if coupon is None:
+        coupon = (
+            Coupon.objects.annotate(code_upper=Upper('code'))
+            .filter(code_upper=normalize_code(code))
+            .first()
+        ) or NO_COUPON
+        cache.set(key, coupon, COUPON_CACHE_TTL)
+    return coupon or None
+
+def forget_coupon(code):
+    # Called whenever a coupon is saved or deleted (see coupons/signals.py)
+    cache.delete(coupon_cache_key(code))
@@ -0,0 +1,68 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from coupons.models import Promotion
+from coupons.promotions import Line, PromotionPlan
+
+
+class Command(BaseCommand):
+    help = "Time the promotion engine on a generated basket and rule set, without touching the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=100)
+        parser.add_argument('--lines', type=int, default=50)
+        parser.add_argument('--runs', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        # few categories and brands so most rules match part of the basket
+        categories, brands = range(1, 11), range(1, 11)
+
+        promotions = []
+        for i in range(options['rules']):
+            kind = rng.choice(['percentage', 'fixed', 'buy_x_get_y'])
+            promotions.append(Promotion(
+                id=i + 1,
+                name=f"Promotion {i + 1}",
+                kind=kind,
+                value=Decimal(rng.choice([5, 10, 20, 50, 100])),
+                category_id=rng.choice([None, *categories]),
+                brand_id=rng.choice([None, None, *brands]),
+                min_subtotal=rng.choice([None, Decimal(500), Decimal(2000)]),
+                buy_quantity=2 if kind == 'buy_x_get_y' else 0,
+                get_quantity=1 if kind == 'buy_x_get_y' else 0,
+                stackable=rng.random() < 0.8,
+                priority=rng.randrange(10),
+                valid_from=now - timedelta(days=1),
+                valid_until=now + timedelta(days=1),
+            ))
+        lines = [
+            Line(rng.choice(categories), rng.choice(brands), Decimal(rng.randrange(100, 100000)) / 100, rng.randint(1, 4))
+            for i in range(options['lines'])
+        ]
+
+        start = time.perf_counter()
+        plan = PromotionPlan(promotions)
+        compiled = time.perf_counter() - start
+
+        timings = []
+        for run in range(options['runs']):
+            start = time.perf_counter()
+            discount, applied = plan.apply(lines, now)
+            timings.append(time.perf_counter() - start)
+
+        self.stdout.write(f"Compiled {len(promotions)} rules in {compiled * 1000:.2f}ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(lines)} lines against {len(promotions)} rules: "
+            f"median {statistics.median(timings) * 1e6:.0f}µs, "
+            f"p99 {sorted(timings)[int(len(timings) * 0.99)] * 1e6:.0f}µs "
+            f"({len(applied)} promotions applied, {discount} off)"
+        ))
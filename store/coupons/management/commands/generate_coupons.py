@@ -0,0 +1,124 @@
+import csv
+import secrets
+import time
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from coupons.models import Coupon
+
+# Uppercase without 0/O and 1/I, codes are typed in by hand. 32 symbols: each random
+# byte maps to one symbol without bias
+ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+SYMBOLS = bytes.maketrans(bytes(range(256)), (ALPHABET * 8).encode())
+# refills of one batch before giving up, each one normally replaces a handful of collisions
+MAX_REFILLS = 10
+
+
+def random_codes(count, length, prefix=''):
+    # count random codes from one read of the OS random source, much faster than secrets.choice per symbol
+    symbols = secrets.token_bytes(count * length).translate(SYMBOLS).decode()
+    return [prefix + symbols[i:i + length] for i in range(0, count * length, length)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Create single-use (or --usage-limit) coupons with random unique codes "
+        "and write the codes to a CSV file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int)
+        parser.add_argument('output', help="CSV file the codes are written to")
+        parser.add_argument('--discount', required=True, help="Percentage or fixed amount")
+        parser.add_argument('--type', choices=['percentage', 'fixed'], default='percentage')
+        parser.add_argument('--days', type=int, default=30, help="Valid from now for this many days")
+        parser.add_argument('--usage-limit', type=int, default=1)
+        parser.add_argument('--prefix', default='', help="e.g. the campaign, part of the 15 characters")
+        parser.add_argument('--length', type=int, default=10, help="Random characters after the prefix")
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        prefix = options['prefix'].upper()
+        length = options['length']
+        max_length = Coupon._meta.get_field('code').max_length
+        if length < 1 or len(prefix) + length > max_length:
+            raise CommandError(f"Prefix and random part must fit in {max_length} characters")
+        # at most half the possible codes in use, counting earlier runs with the same prefix,
+        # so collisions stay rare and the refills short
+        existing = Coupon.objects.alias(code_length=Length('code')).filter(
+            code__startswith=prefix, code_length=len(prefix) + length
+        ).count()
+        if existing + count > len(ALPHABET) ** length // 2:
+            raise CommandError(
+                f"--length {length} is too short for {count} more codes ({existing} taken with this prefix)"
+            )
+        try:
+            discount = Decimal(options['discount'])
+        except InvalidOperation:
+            raise CommandError("--discount must be a number")
+
+        now = timezone.now()
+        template = Coupon(
+            code='',
+            discount=discount,
+            discount_type=options['type'],
+            valid_from=now,
+            valid_until=now + timedelta(days=options['days']),
+            usage_limit=options['usage_limit'],
+        )
+        # every column but the id and the code, in the database format of the template's values
+        fields = [field for field in Coupon._meta.concrete_fields if not field.primary_key and field.name != 'code']
+        self.columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        self.values = [field.get_db_prep_save(getattr(template, field.attname), connection) for field in fields]
+
+        created = 0
+        start = time.monotonic()
+        try:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(['code'])
+                while created < count:
+                    batch = min(options['batch_size'], count - created)
+                    codes = self.insert_batch(batch, length, prefix)
+                    # only committed codes are written, an interrupted run leaves a usable file
+                    writer.writerows([code] for code in codes)
+                    created += len(codes)
+                    self.stdout.write(f"{created} coupons created")
+        except OSError as e:
+            raise CommandError(f"Can't write {options['output']}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created} coupons in {time.monotonic() - start:.1f}s, codes in {options['output']}"
+        ))
+
+    @transaction.atomic
+    def insert_batch(self, count, length, prefix):
+        # Insert count new coupons and return their codes. Codes already taken (by an
+        # earlier batch or another campaign) are skipped by ON CONFLICT instead of failing
+        # the batch, and replaced by new random ones until the batch is full. The codes are
+        # sent as one array, the other columns are the same on every row
+        inserted = []
+        placeholders = ', '.join(['%s'] * len(self.values))
+        for _ in range(MAX_REFILLS + 1):
+            codes = random_codes(count - len(inserted), length, prefix)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {Coupon._meta.db_table} (code, {self.columns})
+                    SELECT code, {placeholders} FROM unnest(%s::text[]) AS code
+                    ON CONFLICT (code) DO NOTHING
+                    RETURNING code
+                    """,
+                    [*self.values, codes],
+                )
+                inserted += [code for code, in cursor.fetchall()]
+            if len(inserted) == count:
+                return inserted
+        # the code space is nearly used up (e.g. by another run at the same time)
+        raise CommandError(f"Could not find {count} free codes, use a longer --length or another --prefix")
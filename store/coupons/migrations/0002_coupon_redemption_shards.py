@@ -0,0 +1,32 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='redemption_shards',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Spread redemptions over this many counters for very hot codes, 0 for a single counter'),
+        ),
+        migrations.CreateModel(
+            name='CouponRedemptionShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('capacity', models.PositiveIntegerField(blank=True, null=True)),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='coupons.coupon')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('coupon', 'shard'), name='unique_coupon_shard')],
+            },
+        ),
+    ]
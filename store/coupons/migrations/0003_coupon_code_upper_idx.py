@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:43
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0002_coupon_redemption_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(django.db.models.functions.text.Upper('code'), name='coupon_code_upper_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0003_coupon_code_upper_idx'),
+        ('products', '0011_related_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('percentage', 'Percentage off'), ('fixed', 'Fixed amount off'), ('buy_x_get_y', 'Buy X get Y')], default='percentage', max_length=12)),
+                ('value', models.DecimalField(decimal_places=2, help_text='Percentage or amount off, for buy X get Y the percentage off the Y items (100 makes them free)', max_digits=10)),
+                ('min_subtotal', models.DecimalField(blank=True, decimal_places=2, help_text='Of the items in scope, empty for none', max_digits=10, null=True)),
+                ('buy_quantity', models.PositiveSmallIntegerField(default=0)),
+                ('get_quantity', models.PositiveSmallIntegerField(default=0)),
+                ('stackable', models.BooleanField(default=True, help_text='Combined with the other stackable promotions, otherwise only used when it alone gives more')),
+                ('priority', models.PositiveSmallIntegerField(default=0, help_text='Lower first, each stacked promotion discounts what the earlier ones left')),
+                ('active', models.BooleanField(default=True)),
+                ('valid_from', models.DateTimeField()),
+                ('valid_until', models.DateTimeField()),
+                ('brand', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.brand')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0004_promotion'),
+        ('products', '0011_related_products'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='promotion',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('kind', 'buy_x_get_y'), _negated=True), models.Q(('buy_quantity__gt', 0), ('get_quantity__gt', 0)), _connector='OR'), name='promotion_buy_x_get_y_quantities', violation_error_message='Buy X get Y promotions need both quantities'),
+        ),
+    ]
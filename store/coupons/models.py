@@ -1,7 +1,11 @@
 from django.db import models
+from django.db.models import Sum
+from django.db.models.functions import Upper
+from django.utils.functional import cached_property
 
 # Create your models here.
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 class Coupon(models.Model):
@@ -18,6 +22,15 @@ class Coupon(models.Model):
     valid_until = models.DateTimeField()
     usage_limit = models.PositiveIntegerField(null=True, blank=True, help_text="Empty for unlimited usage")
     usage_count = models.PositiveIntegerField(default=0)
+    redemption_shards = models.PositiveSmallIntegerField(
+        default=0, help_text="Spread redemptions over this many counters for very hot codes, 0 for a single counter"
+    )
+
+    class Meta:
+        indexes = [
+            # codes are looked up case insensitively (see coupons/lookup.py), the unique index on code can't serve that
+            models.Index(Upper('code'), name='coupon_code_upper_idx'),
+        ]
 
     def __str__(self):
         return f"{self.code} ({self.discount_type})"
@@ -29,8 +42,83 @@ class Coupon(models.Model):
             return False
         if self.valid_from > now or self.valid_until < now:
             return False
-        if self.usage_limit and self.usage_count >= self.usage_limit:
+        if self.usage_limit and self.times_used >= self.usage_limit:
             return False
         return True
 
-    
+    @property
+    def times_used(self):
+        return self.usage_count + (self.shard_uses if self.redemption_shards else 0)
+
+    @cached_property
+    def shard_uses(self):
+        # the shard counters of a sharded coupon are only summed when read
+        return self.shards.aggregate(total=Sum('count'))['total'] or 0
+
+    # discount taken off the given amount, never more than the amount itself
+    def discount_for(self, amount):
+        if self.discount_type == 'percentage':
+            return amount * self.discount / 100
+        return min(self.discount, amount)
+
+
+# One counter of a sharded coupon (see coupons/redemption.py)
+class CouponRedemptionShard(models.Model):
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    capacity = models.PositiveIntegerField(null=True, blank=True) # this counter's share of the usage limit, empty for unlimited
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['coupon', 'shard'], name='unique_coupon_shard')
+        ]
+
+
+# Automatic discount applied to every cart it matches, no code needed. Compiled into the
+# plan coupons/promotions.py evaluates, the plan is rebuilt whenever a promotion changes
+class Promotion(models.Model):
+    KIND_CHOICES = (
+        ('percentage', 'Percentage off'),
+        ('fixed', 'Fixed amount off'),
+        ('buy_x_get_y', 'Buy X get Y'),
+    )
+
+    name = models.CharField(max_length=100) # shown in the cart
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES, default='percentage')
+    value = models.DecimalField(
+        max_digits=10, decimal_places=2,
+        help_text="Percentage or amount off, for buy X get Y the percentage off the Y items (100 makes them free)"
+    )
+    # scope: the promotion only sees the items of this category and/or brand, all items when empty
+    category = models.ForeignKey('products.Category', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    brand = models.ForeignKey('products.Brand', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    min_subtotal = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True, help_text="Of the items in scope, empty for none"
+    )
+    buy_quantity = models.PositiveSmallIntegerField(default=0)
+    get_quantity = models.PositiveSmallIntegerField(default=0)
+    stackable = models.BooleanField(
+        default=True, help_text="Combined with the other stackable promotions, otherwise only used when it alone gives more"
+    )
+    priority = models.PositiveSmallIntegerField(default=0, help_text="Lower first, each stacked promotion discounts what the earlier ones left")
+    active = models.BooleanField(default=True)
+    valid_from = models.DateTimeField()
+    valid_until = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # the engine divides by buy + get, also enforced for promotions saved outside the admin
+            models.CheckConstraint(
+                condition=~models.Q(kind='buy_x_get_y') | models.Q(buy_quantity__gt=0, get_quantity__gt=0),
+                name='promotion_buy_x_get_y_quantities',
+                violation_error_message="Buy X get Y promotions need both quantities",
+            )
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.kind != 'fixed' and self.value > 100:
+            raise ValidationError("A percentage can't be over 100")
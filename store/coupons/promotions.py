@@ -0,0 +1,173 @@
+import time
+from collections import defaultdict, namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Promotion
+
+PROMOTIONS_VERSION_KEY = 'promotions:version'
+CENT = Decimal('0.01')
+
+# One cart or order line as the engine sees it, built from already loaded rows
+Line = namedtuple('Line', 'category_id brand_id unit_price quantity')
+AppliedPromotion = namedtuple('AppliedPromotion', 'id name amount')
+# Subtotal, discounts and total of a list of lines (see price_lines)
+BasketPrice = namedtuple('BasketPrice', 'subtotal promotions promotion_discount coupon_discount discount total')
+
+
+def cents(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class Rule:
+    # A promotion reduced to what evaluating it needs: plain attributes, no model instance
+    __slots__ = (
+        'id', 'name', 'kind', 'rate', 'amount', 'scope', 'min_subtotal', 'buy', 'get',
+        'stackable', 'valid_from', 'valid_until',
+    )
+
+    def __init__(self, promotion):
+        self.id = promotion.id
+        self.name = promotion.name
+        self.kind = promotion.kind
+        self.rate = promotion.value / 100
+        self.amount = promotion.value
+        self.scope = (promotion.category_id, promotion.brand_id)
+        self.min_subtotal = promotion.min_subtotal
+        self.buy = promotion.buy_quantity
+        self.get = promotion.get_quantity
+        self.stackable = promotion.stackable
+        self.valid_from = promotion.valid_from
+        self.valid_until = promotion.valid_until
+
+    def apply(self, lines, amounts, indexes, remaining):
+        """
+        Discount of this rule on the lines at `indexes`, taken off `remaining` (what is
+        left to pay on each line) so stacked rules never discount a line below zero.
+        `amounts` are the undiscounted line totals.
+        """
+        if self.min_subtotal and sum(amounts[i] for i in indexes) < self.min_subtotal:
+            return 0
+
+        total = 0
+        if self.kind == 'percentage':
+            for i in indexes:
+                discount = min(cents(remaining[i] * self.rate), remaining[i])
+                remaining[i] -= discount
+                total += discount
+        elif self.kind == 'fixed':
+            left = self.amount
+            for i in indexes:
+                discount = min(remaining[i], left)
+                remaining[i] -= discount
+                total += discount
+                left -= discount
+        else:
+            # every buy + get units in scope, the cheapest get units are discounted
+            free = sum(lines[i].quantity for i in indexes) // (self.buy + self.get) * self.get
+            for i in sorted(indexes, key=lambda i: lines[i].unit_price):
+                if not free:
+                    break
+                units = min(free, lines[i].quantity)
+                discount = min(cents(lines[i].unit_price * units * self.rate), remaining[i])
+                remaining[i] -= discount
+                total += discount
+                free -= units
+        return total
+
+
+class PromotionPlan:
+    """
+    The live promotions compiled for evaluation: rules in priority order, bucketed by
+    scope, so a basket is matched with one pass over its lines and only meets the rules
+    of its own categories and brands.
+    """
+
+    def __init__(self, promotions):
+        promotions = sorted(promotions, key=lambda promotion: (promotion.priority, promotion.id or 0))
+        self.rules = [Rule(promotion) for promotion in promotions]
+        # (category_id or None, brand_id or None) -> positions in self.rules
+        self.by_scope = defaultdict(list)
+        for position, rule in enumerate(self.rules):
+            self.by_scope[rule.scope].append(position)
+
+    def apply(self, lines, at=None):
+        # Returns (discount, [AppliedPromotion]): the stackable rules together, or the
+        # best exclusive rule alone when it gives more
+        if not self.rules or not lines:
+            return 0, []
+        at = at or timezone.now()
+
+        matched = defaultdict(list) # position -> indexes of the lines in its scope
+        for index, line in enumerate(lines):
+            scopes = {
+                (None, None), (line.category_id, None), (None, line.brand_id), (line.category_id, line.brand_id)
+            }
+            for scope in scopes:
+                for position in self.by_scope.get(scope, ()):
+                    matched[position].append(index)
+
+        amounts = [line.unit_price * line.quantity for line in lines]
+        live = [
+            (self.rules[position], indexes) for position, indexes in sorted(matched.items())
+            if self.rules[position].valid_from <= at <= self.rules[position].valid_until
+        ]
+
+        discount, applied = 0, []
+        remaining = list(amounts)
+        for rule, indexes in live:
+            if rule.stackable:
+                amount = rule.apply(lines, amounts, indexes, remaining)
+                if amount:
+                    discount += amount
+                    applied.append(AppliedPromotion(rule.id, rule.name, amount))
+        for rule, indexes in live:
+            if not rule.stackable:
+                amount = rule.apply(lines, amounts, indexes, list(amounts))
+                if amount > discount:
+                    discount, applied = amount, [AppliedPromotion(rule.id, rule.name, amount)]
+        return discount, applied
+
+
+# The compiled plan of this process and the version it was built for. The version lives in
+# the shared cache, so saving a promotion in any process makes every process recompile
+_plan = (None, None)
+
+def get_promotions_version():
+    version = cache.get(PROMOTIONS_VERSION_KEY)
+    if version is None:
+        # start from the clock so a cache flush never reuses an old version number
+        cache.add(PROMOTIONS_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(PROMOTIONS_VERSION_KEY)
+    return version
+
+def bump_promotions_version():
+    try:
+        return cache.incr(PROMOTIONS_VERSION_KEY)
+    except ValueError: # key missing (first run or evicted)
+        get_promotions_version()
+        return cache.incr(PROMOTIONS_VERSION_KEY)
+
+def get_promotion_plan():
+    # One cache read per call, the promotions are only queried and compiled after a change
+    global _plan
+    version = get_promotions_version()
+    if _plan[0] != version:
+        # rules not started yet are compiled too, apply() skips them until valid_from
+        promotions = Promotion.objects.filter(active=True, valid_until__gt=timezone.now())
+        _plan = (version, PromotionPlan(promotions))
+    return _plan[1]
+
+def price_lines(lines, coupon=None):
+    """
+    Price lines with the live promotions, then the coupon on what they left. Shared by
+    cart pricing and order updates so both discount the same way; the caller decides
+    whether the coupon still applies.
+    """
+    subtotal = sum(line.unit_price * line.quantity for line in lines)
+    promotion_discount, promotions = get_promotion_plan().apply(lines) if lines else (0, [])
+    coupon_discount = coupon.discount_for(subtotal - promotion_discount) if coupon is not None else 0
+    discount = promotion_discount + coupon_discount
+    return BasketPrice(subtotal, promotions, promotion_discount, coupon_discount, discount, subtotal - discount)
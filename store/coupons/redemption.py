@@ -0,0 +1,74 @@
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum
+
+from .models import Coupon, CouponRedemptionShard
+
+# usage_limit empty or 0 means unlimited, as in Coupon.is_valid
+HAS_USES_LEFT = Q(usage_limit__isnull=True) | Q(usage_limit=0) | Q(usage_count__lt=F('usage_limit'))
+
+def redeem_coupon(coupon):
+    """
+    Claim one use of a coupon, False when its usage limit is reached.
+
+    The limit check and the increment are one conditional UPDATE, so concurrent checkouts
+    can't redeem more uses than the limit. The row stays locked until the caller's
+    transaction commits; hot codes can use several counters instead (redemption_shards).
+    """
+    if coupon.redemption_shards:
+        return redeem_from_shard(coupon)
+    return bool(Coupon.objects.filter(HAS_USES_LEFT, pk=coupon.pk).update(usage_count=F('usage_count') + 1))
+
+def redeem_from_shard(coupon):
+    # Take one use from any counter with room left. SKIP LOCKED moves past counters held
+    # by other checkouts, so they don't queue on a single row; only when every counter
+    # is busy does the second attempt wait for one
+    table = CouponRedemptionShard._meta.db_table
+    while True:
+        for lock in ('FOR UPDATE SKIP LOCKED', 'FOR UPDATE'):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    UPDATE {table} SET count = count + 1
+                    WHERE id = (
+                        SELECT id FROM {table}
+                        WHERE coupon_id = %s AND (capacity IS NULL OR count < capacity)
+                        ORDER BY random()
+                        LIMIT 1
+                        {lock}
+                    )
+                    RETURNING id
+                    """,
+                    [coupon.pk],
+                )
+                if cursor.fetchone():
+                    return True
+        # the counter waited for may have filled up meanwhile while others still have room
+        if not coupon.shards.filter(Q(capacity__isnull=True) | Q(count__lt=F('capacity'))).exists():
+            return False
+
+@transaction.atomic
+def set_redemption_shards(coupon, shards):
+    """
+    Switch a coupon between a single counter (shards=0) and `shards` counters.
+
+    The counts so far are folded into usage_count and what's left of the usage limit is
+    split between the new counters. Call it again after changing the usage limit.
+    """
+    coupon = Coupon.objects.select_for_update().get(pk=coupon.pk)
+    used = coupon.shards.aggregate(total=Sum('count'))['total'] or 0
+    coupon.shards.all().delete()
+    coupon.usage_count += used
+    coupon.redemption_shards = shards
+    coupon.save(update_fields=['usage_count', 'redemption_shards'])
+
+    if shards:
+        remaining = max(coupon.usage_limit - coupon.usage_count, 0) if coupon.usage_limit else None
+        CouponRedemptionShard.objects.bulk_create([
+            CouponRedemptionShard(
+                coupon=coupon,
+                shard=shard,
+                capacity=None if remaining is None else remaining // shards + (shard < remaining % shards),
+            )
+            for shard in range(shards)
+        ])
+    return coupon
@@ -2,11 +2,16 @@ from rest_framework import serializers
 from .models import Coupon
 
 class CouponSerializer(serializers.ModelSerializer):
-    is_valid = serializers.BooleanField(read_only=True)
+    is_valid = serializers.SerializerMethodField()
 
     class Meta:
         model = Coupon
         fields = [
             'id', 'code', 'discount', 'discount_type', 'active', 
             'valid_from', 'valid_until', 'usage_limit', 'usage_count', 'is_valid'
-        ]
\ No newline at end of file
+        ]
+
+    def get_is_valid(self, obj):
+        # nested in a cart, the validity its pricing already checked
+        pricing = getattr(self.parent, 'pricing', None)
+        return pricing.coupon_valid if pricing is not None else obj.is_valid
@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Coupon, Promotion
+from .lookup import forget_coupon
+from .promotions import bump_promotions_version
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def coupon_changed(sender, instance, **kwargs):
+    # after commit, like cart_changed: deleted earlier a concurrent lookup could cache the old row.
+    # A renamed code stays cached under the old one until COUPON_CACHE_TTL runs out
+    code = instance.code
+    transaction.on_commit(lambda: forget_coupon(code))
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def promotion_changed(sender, instance, **kwargs):
+    # every process recompiles its promotion plan on its next pricing
+    transaction.on_commit(bump_promotions_version)
@@ -1,11 +1,27 @@
 from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.utils import timezone
+from django.core.cache import cache
 from django.contrib.auth.models import User
-from products.models import Product, Category
+from rest_framework.test import APIClient
+from products.models import Product, Category, Brand
 from cart.models import Cart, CartItem
-from coupons.models import Coupon
+from coupons.models import Coupon, Promotion
+from coupons.promotions import Line, PromotionPlan, bump_promotions_version
+from orders.models import Order
+from coupons.redemption import redeem_coupon, set_redemption_shards
+from coupons.lookup import get_coupon
+from coupons.management.commands.generate_coupons import MAX_REFILLS
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
 from decimal import Decimal
 import datetime
+import csv
+import os
+import tempfile
+from unittest import mock
 
 class CouponModelTest(TestCase):
     def setUp(self):
@@ -73,3 +89,220 @@ class CouponApplicationTest(TestCase):
         self.cart.coupon = self.coupon_fixed
         self.cart.save()
         self.assertEqual(self.cart.total_price, Decimal('180.00'))
+
+
+class CouponRedemptionTest(TestCase):
+    def setUp(self):
+        self.coupon = Coupon.objects.create(
+            code='FLASH',
+            discount=Decimal('10.00'),
+            discount_type='percentage',
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1),
+            usage_limit=5
+        )
+
+    def test_redemptions_stop_at_the_limit(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(usage_count=3)
+        self.assertEqual([redeem_coupon(self.coupon) for i in range(3)], [True, True, False])
+        self.assertEqual(Coupon.objects.get().usage_count, 5)
+
+    def test_sharded_counters_share_the_limit(self):
+        redeem_coupon(self.coupon)
+        coupon = set_redemption_shards(self.coupon, 3)
+        self.assertEqual(sorted(coupon.shards.values_list('capacity', flat=True)), [1, 1, 2])
+
+        self.assertEqual([redeem_coupon(coupon) for i in range(5)], [True, True, True, True, False])
+        coupon = Coupon.objects.get()
+        self.assertEqual(coupon.usage_count, 1) # the shards are summed when read
+        self.assertEqual(coupon.times_used, 5)
+        self.assertFalse(coupon.is_valid)
+
+        # back to a single counter keeps the count
+        coupon = set_redemption_shards(coupon, 0)
+        self.assertEqual(coupon.usage_count, 5)
+        self.assertFalse(coupon.shards.exists())
+
+
+class CouponLookupTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.coupon = Coupon.objects.create(
+            code='Summer10',
+            discount=Decimal('10.00'),
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1)
+        )
+
+    def test_lookup_ignores_case_and_is_cached(self):
+        self.assertEqual(get_coupon(' summer10'), self.coupon)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_coupon('SUMMER10'), self.coupon)
+
+    def test_unknown_codes_are_cached(self):
+        self.assertIsNone(get_coupon('NOPE'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_coupon('nope'))
+
+        # creating it drops the cached miss
+        with self.captureOnCommitCallbacks(execute=True):
+            Coupon.objects.create(
+                code='NOPE', discount=Decimal('5.00'),
+                valid_from=self.coupon.valid_from, valid_until=self.coupon.valid_until
+            )
+        self.assertIsNotNone(get_coupon('nope'))
+
+    def test_saving_drops_the_cached_coupon(self):
+        self.assertTrue(get_coupon('summer10').is_valid)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coupon.active = False
+            self.coupon.save()
+        self.assertFalse(get_coupon('summer10').is_valid)
+
+
+class GenerateCouponsTest(TestCase):
+    def generate(self, count, **options):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'codes.csv')
+        call_command('generate_coupons', count, path, discount='15', stdout=StringIO(), **options)
+        with open(path, newline='') as file:
+            return [row['code'] for row in csv.DictReader(file)]
+
+    def test_codes_are_created_and_written(self):
+        codes = self.generate(50, prefix='spr', batch_size=20)
+        self.assertEqual(len(set(codes)), 50)
+        self.assertTrue(all(len(code) == 13 and code.startswith('SPR') for code in codes))
+        self.assertEqual(set(Coupon.objects.values_list('code', flat=True)), set(codes))
+        coupon = Coupon.objects.get(code=codes[0])
+        self.assertEqual((coupon.usage_limit, coupon.discount), (1, Decimal('15')))
+
+    def test_taken_codes_are_replaced(self):
+        # 32 possible codes, 10 of them taken
+        Coupon.objects.bulk_create([
+            Coupon(code=f'X{symbol}', discount=1, valid_from=timezone.now(), valid_until=timezone.now())
+            for symbol in 'ABCDEFGHJK'
+        ])
+        codes = self.generate(6, prefix='X', length=1)
+        self.assertEqual(len(set(codes)), 6)
+        self.assertEqual(Coupon.objects.count(), 16)
+        self.assertFalse(set(codes) & {f'X{symbol}' for symbol in 'ABCDEFGHJK'})
+
+    def test_taken_codes_count_against_the_capacity(self):
+        Coupon.objects.bulk_create([
+            Coupon(code=f'X{symbol}', discount=1, valid_from=timezone.now(), valid_until=timezone.now())
+            for symbol in 'ABCDEFGHJK'
+        ])
+        with self.assertRaises(CommandError):
+            self.generate(7, prefix='X', length=1)
+        self.assertEqual(Coupon.objects.count(), 10)
+
+    def test_gives_up_when_no_free_code_is_found(self):
+        Coupon.objects.create(code='XA', discount=1, valid_from=timezone.now(), valid_until=timezone.now())
+        with mock.patch(
+            'coupons.management.commands.generate_coupons.random_codes', return_value=['XA']
+        ) as random_codes, self.assertRaises(CommandError):
+            self.generate(1, prefix='X', length=1)
+        self.assertEqual(random_codes.call_count, MAX_REFILLS + 1)
+
+    def test_codes_must_fit_the_field(self):
+        with self.assertRaises(CommandError):
+            self.generate(10, prefix='SUMMERSALE', length=6)
+
+
+class PromotionPlanTest(TestCase):
+    # the engine alone, on unsaved promotions
+    def promotion(self, **fields):
+        fields = {
+            'id': fields.get('priority', 0) + 1,
+            'name': 'Sale',
+            'value': Decimal('10'),
+            'valid_from': timezone.now() - datetime.timedelta(days=1),
+            'valid_until': timezone.now() + datetime.timedelta(days=1),
+            **fields,
+        }
+        return Promotion(**fields)
+
+    def apply(self, promotions, lines):
+        discount, applied = PromotionPlan(promotions).apply([Line(*line) for line in lines])
+        return discount, [(promotion.name, promotion.amount) for promotion in applied]
+
+    def test_scope_and_minimum_subtotal(self):
+        lines = [(1, 1, Decimal('100.00'), 2), (2, 1, Decimal('50.00'), 1)]
+        self.assertEqual(self.apply([self.promotion(category_id=1)], lines), (Decimal('20.00'), [('Sale', Decimal('20.00'))]))
+        self.assertEqual(self.apply([self.promotion(brand_id=1)], lines)[0], Decimal('25.00'))
+        self.assertEqual(self.apply([self.promotion(category_id=2, min_subtotal=Decimal('60'))], lines), (0, []))
+
+    def test_buy_x_get_y_discounts_the_cheapest_items(self):
+        lines = [(1, 1, Decimal('30.00'), 2), (1, 1, Decimal('10.00'), 2), (1, 1, Decimal('20.00'), 3)]
+        promotion = self.promotion(kind='buy_x_get_y', value=Decimal('100'), buy_quantity=2, get_quantity=1)
+        # 7 items: 2 free, both 10.00
+        self.assertEqual(self.apply([promotion], lines)[0], Decimal('20.00'))
+
+    def test_stacking(self):
+        lines = [(1, 1, Decimal('100.00'), 1)]
+        first = self.promotion(name='First', priority=0, value=Decimal('50'))
+        second = self.promotion(name='Second', priority=1, kind='fixed', value=Decimal('30'))
+        # the fixed amount is taken off what the percentage left
+        self.assertEqual(self.apply([second, first], lines), (Decimal('80.00'), [('First', Decimal('50.00')), ('Second', Decimal('30'))]))
+        second.value = Decimal('80')
+        self.assertEqual(self.apply([first, second], lines)[0], Decimal('100.00'))
+
+        exclusive = self.promotion(name='Exclusive', priority=2, value=Decimal('60'), stackable=False)
+        self.assertEqual(self.apply([first, exclusive], lines), (Decimal('60.00'), [('Exclusive', Decimal('60.00'))]))
+        self.assertEqual(self.apply([first, second, exclusive], lines)[1], [('First', Decimal('50.00')), ('Second', Decimal('50.00'))])
+
+    def test_expired_rules_are_skipped(self):
+        promotion = self.promotion(valid_until=timezone.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(self.apply([promotion], [(1, 1, Decimal('100.00'), 1)]), (0, []))
+
+
+class PromotionCartTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Bags')
+        self.brand = Brand.objects.create(name='Moda')
+        cart = Cart.objects.create(user=self.user)
+        product = Product.objects.create(name='Bag', price=Decimal('100.00'), category=self.category, brand=self.brand, stock=10)
+        CartItem.objects.create(cart=cart, product=product, quantity=3)
+        self.coupon = Coupon.objects.create(
+            code='PCT10',
+            discount=Decimal('10.00'),
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1)
+        )
+        # leave no compiled plan behind for the next tests
+        self.addCleanup(bump_promotions_version)
+
+    def test_promotions_then_coupon(self):
+        self.assertEqual(self.client.get('/api/cart/').data['total_price'], Decimal('300.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Promotion.objects.create(
+                name='Buy 2 get 1', kind='buy_x_get_y', value=Decimal('100'), buy_quantity=2, get_quantity=1,
+                category=self.category, valid_from=self.coupon.valid_from, valid_until=self.coupon.valid_until
+            )
+        self.client.post('/api/cart/apply_coupon/', {'code': 'PCT10'})
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/')
+
+        # one bag free, then 10% off the remaining 200.00
+        self.assertEqual(response.data['promotions'][0]['amount'], Decimal('100.00'))
+        self.assertEqual(response.data['discount'], Decimal('120.00'))
+        self.assertEqual(response.data['total_price'], Decimal('180.00'))
+
+        response = self.client.post('/api/cart/checkout/', {'phone': '0100', 'address': 'Cairo', 'payment_method': 'cod'})
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertEqual((order.discount_amount, order.total_price), (Decimal('120.00'), Decimal('180.00')))
+
+    def test_buy_x_get_y_needs_both_quantities(self):
+        promotion = Promotion(
+            name='Buy 0 get 0', kind='buy_x_get_y', value=Decimal('100'),
+            valid_from=self.coupon.valid_from, valid_until=self.coupon.valid_until
+        )
+        with self.assertRaises(ValidationError):
+            promotion.full_clean()
+        # saved outside the admin, the database refuses it
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            promotion.save()
@@ -1,14 +1,21 @@
 from django.contrib import admin
 from .models import Order, OrderItem
+from store.paginator import EstimatedCountPaginator
 
 # Register your models here.
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id','payment_reference' ,'user', 'status', 'address', 'total_price', 'created_at')
     search_fields = ('user__username', 'payment_reference')
     list_filter = ('status', 'created_at')
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [OrderItemInline]
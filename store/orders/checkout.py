@@ -0,0 +1,142 @@
+from django.db import OperationalError, connection, transaction
+from psycopg2 import errorcodes
+
+from cart.models import Cart
+from cart.pricing import load_cart, price_cart
+from coupons.redemption import redeem_coupon
+from products.models import Product
+from products.cache import bump_catalog_version
+from .models import Order, OrderItem
+from .holds import held_stock, create_holds, release_holds
+
+MAX_ATTEMPTS = 3
+# raised by PostgreSQL when concurrent transactions can't both commit, safe to run again
+RETRYABLE_ERRORS = (errorcodes.SERIALIZATION_FAILURE, errorcodes.DEADLOCK_DETECTED)
+
+class CheckoutError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def place_order(user, cart_id, phone, address, status):
+    """
+    Turn the cart into an order in one transaction, retried on serialization failures
+    and deadlocks. Raises CheckoutError when the cart can't be ordered; nothing is
+    written then.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return _place_order(user, cart_id, phone, address, status)
+        except OperationalError as e:
+            if getattr(e.__cause__, 'pgcode', None) not in RETRYABLE_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+
+def _place_order(user, cart_id, phone, address, status):
+    # The cart row is locked first: a second checkout of the same cart (double click,
+    # retried request) waits here and then finds it checked out
+    if not Cart.objects.select_for_update().filter(pk=cart_id, is_active=True).exists():
+        raise CheckoutError("Cart is already checked out", status=409)
+    cart = load_cart(pk=cart_id)
+    pricing = price_cart(cart)
+    if not pricing.items:
+        raise CheckoutError("Cart is empty")
+
+    quantities = {item.product_id: item.quantity for item in pricing.items}
+    check_available(pricing.items, quantities)
+
+    order = Order.objects.create(
+        user=user,
+        total_price=pricing.total,
+        coupon=cart.coupon if pricing.coupon_valid else None, # order updates reapply the order's coupon
+        discount_amount=pricing.discount,
+        phone=phone,
+        address=address,
+        status=status,
+    )
+    # the unit price the cart charged, product discount included: order updates reprice from it
+    order_items = OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=item.product_id, quantity=item.quantity, price=item.product.final_price)
+        for item in pricing.items
+    ])
+
+    # COD orders take their stock now, online ones hold it until they are paid
+    if status == 'cod':
+        decrement_stock(quantities)
+    else:
+        create_holds(order_items)
+
+    # saving drops the cached active cart id (see cart/signals.py),
+    # the next cart is only created when the user adds an item again
+    cart.is_active = False
+    cart.save(update_fields=['is_active', 'updated_at']) # checked out now, kept --inactive-days from here
+
+    # last, so the coupon's counter is locked for as little of the transaction as possible
+    if pricing.coupon_valid and not redeem_coupon(cart.coupon):
+        raise CheckoutError("Coupon usage limit reached", status=409)
+    return order
+
+def check_available(items, quantities, order=None):
+    # Products are locked in id order, so concurrent checkouts sharing products queue
+    # up instead of deadlocking, and neither the stock nor the holds read below can
+    # change until commit. Available stock is the stock minus what other orders hold
+    stock = dict(
+        Product.objects.filter(id__in=quantities).order_by('id').select_for_update().values_list('id', 'stock')
+    )
+    held = held_stock(quantities, exclude_order=order)
+    for item in items:
+        available = stock.get(item.product_id, 0) - held.get(item.product_id, 0)
+        if available < quantities[item.product_id]:
+            raise CheckoutError(
+                f"Not enough stock for {item.product.name} only {max(available, 0)} left", status=409
+            )
+
+@transaction.atomic
+def hold_order_stock(order):
+    """
+    (Re)hold the stock of a pending order for another STOCK_HOLD_TTL before it is paid,
+    raising CheckoutError when it's no longer available. Called before the payment
+    provider is contacted, no lock is held during those calls.
+    """
+    items = list(order.items.select_related('product'))
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    check_available(items, quantities, order=order)
+    release_holds(order)
+    create_holds(items)
+
+@transaction.atomic
+def take_added_stock(order, quantities):
+    """
+    Take the stock of {product_id: quantity} units added to a COD order, which took the
+    rest of its stock at checkout. Raises CheckoutError when they aren't available.
+    """
+    items = list(order.items.select_related('product').filter(product_id__in=quantities))
+    check_available(items, quantities, order=order)
+    decrement_stock(quantities)
+
+def decrement_stock(quantities):
+    """
+    Take {product_id: quantity} off the stock in a single UPDATE covering every line.
+
+    Each row is only updated while it has enough stock; if any line falls short the
+    whole transaction is rolled back, so stock can never go negative or be oversold.
+    """
+    values = ', '.join(['(%s, %s)'] * len(quantities))
+    table = Product._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} AS product SET stock = product.stock - line.quantity
+            FROM (VALUES {values}) AS line(id, quantity)
+            WHERE product.id = line.id AND product.stock >= line.quantity
+            """,
+            [value for line in quantities.items() for value in line],
+        )
+        if cursor.rowcount != len(quantities):
+            raise CheckoutError("Not enough stock for some of the products", status=409)
+    # update() doesn't send post_save, the cached catalog shows the old stock
+    transaction.on_commit(bump_catalog_version)
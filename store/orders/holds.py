@@ -0,0 +1,92 @@
+import logging
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from products.models import Product
+from products.cache import bump_catalog_version
+from .models import Order, OrderItem, StockHold
+
+logger = logging.getLogger(__name__)
+
+# Matches the Paymob payment key expiration, the buyer can pay until the hold expires
+STOCK_HOLD_TTL = timedelta(hours=1)
+
+def held_stock(product_ids, exclude_order=None):
+    # {product_id: quantity held by unexpired holds}, served by the (product, expires_at) index
+    holds = StockHold.objects.filter(product_id__in=product_ids, expires_at__gt=timezone.now())
+    if exclude_order is not None:
+        holds = holds.exclude(order_item__order=exclude_order)
+    return dict(holds.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+
+def create_holds(order_items):
+    # Hold the stock of each line until STOCK_HOLD_TTL from now
+    expires_at = timezone.now() + STOCK_HOLD_TTL
+    StockHold.objects.bulk_create([
+        StockHold(order_item=item, product_id=item.product_id, quantity=item.quantity, expires_at=expires_at)
+        for item in order_items
+    ])
+
+def release_holds(order):
+    StockHold.objects.filter(order_item__order=order).delete()
+
+def confirm_order_payment(order_id):
+    """
+    Mark a pending order paid and turn its holds into stock deductions.
+
+    Shared by the Paymob webhook and callback, whichever arrives first does the work.
+    The stock is taken with a single UPDATE, and since the holds are deleted in the same
+    transaction, available stock doesn't change. A payment landing after its hold expired
+    is still honoured even if the stock ran out meanwhile; that oversell is logged.
+    Returns the order, or None when it was no longer pending (already paid, or a
+    replayed notification for an order since shipped or cancelled).
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order_id)
+        if order.status != 'pending':
+            return None
+
+        table = Product._meta.db_table
+        with connection.cursor() as cursor:
+            # No product lock up front, the UPDATE only locks each row while taking its stock.
+            # GREATEST: stock can't go negative, the units it couldn't take are returned and
+            # logged (`before` is the row as the statement read it, a sale committing at the
+            # same moment can make the logged count approximate, never the stock)
+            cursor.execute(
+                f"""
+                UPDATE {table} AS product SET stock = GREATEST(product.stock - line.quantity, 0)
+                FROM (
+                    SELECT product_id, SUM(quantity) AS quantity
+                    FROM {OrderItem._meta.db_table}
+                    WHERE order_id = %s
+                    GROUP BY product_id
+                ) AS line
+                JOIN {table} AS before ON before.id = line.product_id
+                WHERE product.id = line.product_id
+                RETURNING product.id, line.quantity - before.stock
+                """,
+                [order.pk],
+            )
+            oversold = {product_id: short for product_id, short in cursor.fetchall() if short > 0}
+        if oversold:
+            logger.warning("Order %s paid after its hold expired, oversold %s (product id: units)", order.pk, oversold)
+        release_holds(order)
+
+        order.status = 'paid'
+        order.save()
+        # update() doesn't send post_save, the cached catalog shows the old stock
+        transaction.on_commit(bump_catalog_version)
+    return order
+
+def release_expired_holds(batch_size=1000):
+    # Delete expired holds in batches so the sweep never holds many row locks at once.
+    # Expired holds are already ignored by held_stock, this only keeps the table small
+    released = 0
+    now = timezone.now()
+    while True:
+        ids = list(StockHold.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return released
+        released += StockHold.objects.filter(id__in=ids, expires_at__lte=now).delete()[0]
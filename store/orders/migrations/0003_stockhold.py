@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_coupon_order_discount_amount_and_more'),
+        ('products', '0011_related_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('order_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='hold', to='orders.orderitem')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at'], name='stockhold_product_expires_idx'), models.Index(fields=['expires_at'], name='stockhold_expires_idx')],
+            },
+        ),
+    ]
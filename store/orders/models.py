@@ -33,6 +33,12 @@ class Order(models.Model):
 
     def __str__(self):
         return f"Order {self.id} - {self.status}"
+
+    class Meta:
+        indexes = [
+            # a user's orders newest first: the order history pages (see orders/pagination.py)
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ]
     
 
 class OrderItem(models.Model):
@@ -42,4 +48,23 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        return f"{self.product.name} x {self.quantity}"
\ No newline at end of file
+        return f"{self.product.name} x {self.quantity}"
+
+# Stock set aside for a line of a pending online order until it is paid or the hold expires.
+# Available stock is product.stock minus the unexpired holds (see orders/holds.py)
+class StockHold(models.Model):
+    order_item = models.OneToOneField(OrderItem, on_delete=models.CASCADE, related_name='hold')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+') # copied from the item for the index below
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}"
+
+    class Meta:
+        indexes = [
+            # unexpired holds of a product: one index range scan
+            models.Index(fields=['product', 'expires_at'], name='stockhold_product_expires_idx'),
+            # expired holds for the sweeper
+            models.Index(fields=['expires_at'], name='stockhold_expires_idx'),
+        ]
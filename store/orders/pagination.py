@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+# Order history, newest first. Keyset pages over the (user, -created_at) index, so a
+# customer with hundreds of orders gets page N as fast as page 1
+class OrderCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at',)
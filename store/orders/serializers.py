@@ -1,4 +1,6 @@
 from rest_framework import serializers
+from products.images import thumbnail_url, srcset
+from products.serializers import first_image
 from coupons.serializers import CouponSerializer
 from .models import Order, OrderItem
 
@@ -6,15 +8,23 @@ class OrderItemSerializer(serializers.ModelSerializer):
     product_price = serializers.ReadOnlyField(source='price')
     total_price = serializers.SerializerMethodField()
     product_image = serializers.SerializerMethodField()
+    product_image_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = OrderItem
-        fields = ['id', 'product', 'product_price', 'quantity', 'total_price', 'product_image']
+        fields = ['id', 'product', 'product_price', 'quantity', 'total_price', 'product_image', 'product_image_srcset']
 
+    # thumbnail sized image, the item rows never need the original
     def get_product_image(self, obj):
-        image = obj.product.images.first()
+        image = first_image(obj.product) # prefetched by order_queryset
         if image:
-            return image.image.url
+            return thumbnail_url(image)
+        return None
+
+    def get_product_image_srcset(self, obj):
+        image = first_image(obj.product)
+        if image:
+            return srcset(image)
         return None
 
     def get_total_price(self, obj):
@@ -1,8 +1,10 @@
+from functools import partial
+from django.db import transaction
 from django.db.models.signals import post_save, post_init
 from django.dispatch import receiver
 from django.core.mail import send_mail
 from django.conf import settings
-from .models import Order
+from .models import Order, StockHold
 
 def send_order_email(subject, message, to_email):
     try:
@@ -16,6 +18,11 @@ def send_order_email(subject, message, to_email):
     except Exception as e:
         print(f"Failed to send email to {to_email}: {e}")
 
+def queue_order_email(subject, message, to_email):
+    # Sent once the order is committed: never for a rolled back checkout,
+    # and the checkout transaction doesn't hold its locks while talking to the mail server
+    transaction.on_commit(partial(send_order_email, subject, message, to_email))
+
 @receiver(post_init, sender=Order)
 def order_post_init(sender, instance, **kwargs):
     """
@@ -109,7 +116,7 @@ def order_status_changed(sender, instance, created, **kwargs):
             """
         
         if message:
-            send_order_email(subject, message, user_email)
+            queue_order_email(subject, message, user_email)
 
     # Admin Notification Logic
     if not created and current_status != original_status:
@@ -122,7 +129,14 @@ New Status: {current_status}
 Total: {instance.total_price} EGP
         """
         admin_email = settings.DEFAULT_FROM_EMAIL
-        send_order_email(subject, message, admin_email)
+        queue_order_email(subject, message, admin_email)
     
     # Update _original_status for subsequent saves on the same instance
     instance._original_status = current_status
+
+
+@receiver(post_save, sender=Order)
+def release_cancelled_order_holds(sender, instance, **kwargs):
+    # A cancelled order gives its held stock back straight away
+    if instance.status == 'cancelled':
+        StockHold.objects.filter(order_item__order=instance).delete()
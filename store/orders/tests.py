@@ -1,3 +1,294 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from products.models import Product, Category, Brand, ProductImage
+from cart.models import Cart, CartItem
+from orders.models import Order, OrderItem, StockHold
+from coupons.models import Coupon
+from orders.holds import confirm_order_payment, release_expired_holds
+from django.utils import timezone
+import datetime
+from decimal import Decimal
 
 # Create your tests here.
+
+class CheckoutTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Bags')
+        self.brand = Brand.objects.create(name='Moda')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def add_products(self, count, stock=5, quantity=2):
+        products = []
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'Bag {i}', price=Decimal('100.00'), category=self.category, brand=self.brand, stock=stock
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+            products.append(product)
+        return products
+
+    def checkout(self, payment_method='cod'):
+        return self.client.post('/api/cart/checkout/', {'phone': '0100', 'address': 'Cairo', 'payment_method': payment_method})
+
+
+class CheckoutTest(CheckoutTestCase):
+    def test_cod_checkout_takes_stock(self):
+        self.add_products(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+
+        order = Order.objects.get()
+        self.assertEqual(order.status, 'cod')
+        self.assertEqual(order.total_price, Decimal('600.00'))
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('stock', flat=True)), [3, 3, 3])
+        self.assertFalse(Cart.objects.get(pk=self.cart.pk).is_active)
+
+        # the cart is gone, checking out again can't order it twice
+        self.assertEqual(self.checkout().status_code, 400)
+
+    def test_online_checkout_keeps_stock_until_paid(self):
+        self.add_products(1)
+        self.assertEqual(self.checkout('online').status_code, 201)
+        self.assertEqual(Order.objects.get().status, 'pending')
+        self.assertEqual(Product.objects.get().stock, 5)
+
+    def test_short_stock_writes_nothing(self):
+        self.add_products(2)
+        self.add_products(1, stock=1)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(list(Product.objects.order_by('id').values_list('stock', flat=True)), [5, 5, 1])
+        self.assertTrue(Cart.objects.get(pk=self.cart.pk).is_active)
+
+    def test_queries_do_not_grow_with_the_basket(self):
+        self.add_products(2)
+        self.client.get('/api/cart/') # caches the active cart id
+        with self.assertNumQueries(12):
+            self.checkout()
+
+        self.cart = Cart.objects.create(user=self.user)
+        self.add_products(20)
+        cache.clear()
+        self.client.get('/api/cart/')
+        with self.assertNumQueries(12):
+            self.checkout()
+
+    def test_checkout_redeems_the_coupon(self):
+        self.add_products(1)
+        coupon = Coupon.objects.create(
+            code='ONCE',
+            discount=Decimal('10.00'),
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1),
+            usage_limit=1
+        )
+        Cart.objects.filter(pk=self.cart.pk).update(coupon=coupon)
+        self.assertEqual(self.checkout().status_code, 201)
+        self.assertEqual(Coupon.objects.get().usage_count, 1)
+
+    def test_invalid_coupon_is_not_recorded(self):
+        self.add_products(1)
+        coupon = Coupon.objects.create(
+            code='OLD',
+            discount=Decimal('10.00'),
+            valid_from=timezone.now() - datetime.timedelta(days=2),
+            valid_until=timezone.now() - datetime.timedelta(days=1)
+        )
+        Cart.objects.filter(pk=self.cart.pk).update(coupon=coupon)
+        self.assertEqual(self.checkout().status_code, 201)
+        order = Order.objects.get()
+        self.assertIsNone(order.coupon)
+        self.assertEqual((order.total_price, order.discount_amount), (Decimal('200.00'), Decimal('0.00')))
+
+    def test_order_update_reprices_with_the_coupon(self):
+        self.add_products(1, quantity=3)
+        coupon = Coupon.objects.create(
+            code='PCT10',
+            discount=Decimal('10.00'),
+            valid_from=timezone.now() - datetime.timedelta(days=1),
+            valid_until=timezone.now() + datetime.timedelta(days=1)
+        )
+        Cart.objects.filter(pk=self.cart.pk).update(coupon=coupon)
+        order_id = self.checkout().data['order_id']
+        item = OrderItem.objects.get()
+
+        response = self.client.post(
+            '/api/orders/update_order/', {'id': order_id, 'items': [{'product_id': item.product_id, 'quantity': 1}]},
+            format='json'
+        )
+        self.assertEqual(response.data['total_price'], Decimal('90.00'))
+        self.assertEqual(Order.objects.get().discount_amount, Decimal('10.00'))
+
+    def test_order_update_keeps_the_product_discount(self):
+        product, = self.add_products(1, quantity=3)
+        Product.objects.filter(pk=product.pk).update(discount=20)
+        response = self.checkout()
+        self.assertEqual(Order.objects.get().total_price, Decimal('240.00'))
+
+        response = self.client.post(
+            '/api/orders/update_order/', {'id': response.data['order_id'], 'items': [{'product_id': product.id, 'quantity': 2}]},
+            format='json'
+        )
+        self.assertEqual(response.data['total_price'], Decimal('160.00'))
+
+
+class StockHoldTest(CheckoutTestCase):
+    def other_buyer(self):
+        user = User.objects.create_user(username='other', password='password')
+        client = APIClient()
+        client.force_authenticate(user)
+        return user, client
+
+    def test_online_orders_hold_their_stock(self):
+        product, = self.add_products(1, stock=3, quantity=2)
+        self.assertEqual(self.checkout('online').status_code, 201)
+        self.assertEqual(StockHold.objects.get().quantity, 2)
+
+        user, client = self.other_buyer()
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+        response = client.post('/api/cart/checkout/', {'phone': '0100', 'address': 'Cairo', 'payment_method': 'cod'})
+        self.assertEqual(response.status_code, 409) # 3 in stock, 2 held
+
+        # once the hold expires the stock is available again
+        StockHold.objects.update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        response = client.post('/api/cart/checkout/', {'phone': '0100', 'address': 'Cairo', 'payment_method': 'cod'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(release_expired_holds(), 1)
+
+    def test_payment_turns_holds_into_deductions(self):
+        self.add_products(2, stock=3, quantity=2)
+        self.checkout('online')
+        order = Order.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(confirm_order_payment(order.id), order)
+        self.assertEqual(Order.objects.get().status, 'paid')
+        # only the order is locked, the stock is taken by the UPDATE alone
+        self.assertEqual([query['sql'] for query in queries if 'FOR UPDATE' in query['sql'] and 'products_product' in query['sql']], [])
+        self.assertFalse(StockHold.objects.exists())
+        self.assertEqual(list(Product.objects.values_list('stock', flat=True)), [1, 1])
+
+        # webhook and callback both confirm, the stock is only taken once
+        self.assertIsNone(confirm_order_payment(order.id))
+        self.assertEqual(list(Product.objects.values_list('stock', flat=True)), [1, 1])
+
+    def test_replayed_payment_after_pending_is_ignored(self):
+        for status in ('shipped', 'cancelled'):
+            product, = self.add_products(1, stock=5, quantity=2)
+            order = Order.objects.get(pk=self.checkout('online').data['order_id'])
+            self.cart = Cart.objects.create(user=self.user) # the next checkout's
+            cache.clear() # cached active cart id, dropped on commit outside tests
+            confirm_order_payment(order.id)
+            order.refresh_from_db()
+            order.status = status
+            order.save()
+
+            self.assertIsNone(confirm_order_payment(order.id))
+            order.refresh_from_db()
+            self.assertEqual(order.status, status)
+            self.assertEqual(Product.objects.get(pk=product.pk).stock, 3)
+
+    def test_raising_a_pending_order_needs_the_stock(self):
+        product, = self.add_products(1, stock=3, quantity=2)
+        order_id = self.checkout('online').data['order_id']
+
+        def update(quantity):
+            return self.client.post(
+                '/api/orders/update_order/', {'id': order_id, 'items': [{'product_id': product.id, 'quantity': quantity}]},
+                format='json'
+            )
+
+        self.assertEqual(update(4).status_code, 409)
+        self.assertEqual((OrderItem.objects.get().quantity, StockHold.objects.get().quantity), (2, 2))
+        self.assertEqual(update(3).status_code, 200)
+        self.assertEqual(StockHold.objects.get().quantity, 3)
+        self.assertEqual(update(1).status_code, 200)
+        self.assertEqual(StockHold.objects.get().quantity, 1)
+
+    def test_raising_a_cod_order_takes_the_stock(self):
+        product, = self.add_products(1, stock=5, quantity=2)
+        order_id = self.checkout().data['order_id']
+
+        def update(quantity):
+            return self.client.post(
+                '/api/orders/update_order/', {'id': order_id, 'items': [{'product_id': product.id, 'quantity': quantity}]},
+                format='json'
+            )
+
+        self.assertEqual(Product.objects.get().stock, 3)
+        self.assertEqual(update(6).status_code, 409) # 3 more left, 4 more asked
+        self.assertEqual((OrderItem.objects.get().quantity, Product.objects.get().stock), (2, 3))
+        self.assertEqual(update(4).status_code, 200)
+        self.assertEqual((OrderItem.objects.get().quantity, Product.objects.get().stock), (4, 1))
+
+    def test_order_update_quantity_must_be_an_integer(self):
+        product, = self.add_products(1)
+        order_id = self.checkout().data['order_id']
+        for items in ([{'product_id': product.id, 'quantity': 'abc'}], [{'product_id': 'abc', 'quantity': 1}], 'abc'):
+            response = self.client.post('/api/orders/update_order/', {'id': order_id, 'items': items}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(OrderItem.objects.get().quantity, 2)
+
+    def test_late_payment_oversell_is_logged(self):
+        product, = self.add_products(1, stock=3, quantity=2)
+        self.checkout('online')
+        Product.objects.filter(pk=product.pk).update(stock=1) # sold elsewhere after the hold expired
+        with self.assertLogs('orders.holds', 'WARNING') as logs:
+            confirm_order_payment(Order.objects.get().id)
+        self.assertIn(f'{{{product.id}: 1}}', logs.output[0])
+        self.assertEqual(Product.objects.get().stock, 0)
+
+    def test_cancelled_order_releases_its_holds(self):
+        self.add_products(1)
+        self.checkout('online')
+        order = Order.objects.get()
+        order.status = 'cancelled'
+        order.save()
+        self.assertFalse(StockHold.objects.exists())
+
+
+class OrderHistoryTest(CheckoutTestCase):
+    def place_orders(self, count):
+        product = Product.objects.create(
+            name='Bag', price=Decimal('100.00'), category=self.category, brand=self.brand, stock=100
+        )
+        ProductImage.objects.create(product=product, image='products/bag.jpg')
+        for i in range(count):
+            order = Order.objects.create(user=self.user, total_price=Decimal('100.00'), phone='0100', address='Cairo', status='cod')
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+
+    def test_orders_are_paginated_in_constant_queries(self):
+        self.place_orders(25)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/orders/user_orders/')
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertTrue(response.data['results'][0]['items'][0]['product_image'])
+
+        ids = [order['id'] for order in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [order['id'] for order in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, list(Order.objects.order_by('-created_at').values_list('id', flat=True)))
+
+    def test_profile_lists_one_page_of_orders(self):
+        self.place_orders(25)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/me/')
+        self.assertEqual(len(response.data['orders']), 20)
+        self.assertEqual(response.data['orders'][0]['total'], Decimal('100.00'))
+        response = self.client.get(response.data['orders_next'])
+        self.assertEqual(len(response.data['orders']), 5)
+        self.assertIsNone(response.data['orders_next'])
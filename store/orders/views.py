@@ -2,16 +2,35 @@ from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
-from .models import Order, OrderItem
+from products.models import ProductImage
+from .models import Order, OrderItem, StockHold
+from .checkout import CheckoutError, hold_order_stock, take_added_stock
 from .serializers import OrderSerializer
+from .pagination import OrderCursorPagination
+from coupons.promotions import Line, price_lines
+
+def order_queryset(user):
+    # The user's orders with everything OrderSerializer reads, in 3 queries per page:
+    # orders + coupon, items + products, then the products' images
+    items = (
+        OrderItem.objects
+        .select_related('product')
+        .defer('product__search_vector', 'product__description')
+        .prefetch_related(Prefetch('product__images', queryset=ProductImage.objects.order_by('id')))
+        .order_by('id')
+    )
+    return Order.objects.filter(user=user).select_related('coupon').prefetch_related(Prefetch('items', queryset=items))
 
 class OrderListView(generics.ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination # ?cursor=...&page_size=...
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).order_by('-created_at')
+        return order_queryset(self.request.user)
 
 class OrderDetailView(generics.RetrieveAPIView):
     serializer_class = OrderSerializer
@@ -19,13 +38,14 @@ class OrderDetailView(generics.RetrieveAPIView):
     lookup_field = 'id'
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return order_queryset(self.request.user)
 
 # Create your views here.
 
 class UpdateOrderView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @transaction.atomic
     def post(self, request):
 
         order_id = request.data.get('id')
@@ -36,7 +56,20 @@ class UpdateOrderView(APIView):
         if not order_id:
             return Response({"error": "Order ID is required"}, status=400)
 
-        order = get_object_or_404(Order, id=order_id, user=request.user)
+        # {product_id: quantity}, checked before anything is written
+        quantities = {}
+        if items_data:
+            if not isinstance(items_data, list) or not all(isinstance(item, dict) for item in items_data):
+                return Response({"error": "items must be a list of {product_id, quantity}"}, status=400)
+            try:
+                for item_data in items_data:
+                    if item_data.get('product_id') is not None and item_data.get('quantity') is not None:
+                        quantities[int(item_data['product_id'])] = int(item_data['quantity'])
+            except (TypeError, ValueError):
+                return Response({"error": "product_id and quantity must be integers"}, status=400)
+
+        # locked: a payment confirmation of the same order waits for the update (see orders/holds.py)
+        order = get_object_or_404(Order.objects.select_for_update(), id=order_id, user=request.user)
 
         if order.status != 'pending' and not order.status == 'cod':
             return Response({"error": "Only pending orders can be updated"}, status=400)
@@ -48,32 +81,44 @@ class UpdateOrderView(APIView):
             order.address = address
 
         if items_data:
+            added = {} # product_id -> units more than the order had
 
-            for item_data in items_data:
-
-                product_id = item_data.get('product_id')
-                quantity = item_data.get('quantity')
-
-                if product_id is None or quantity is None:
-                    continue
-
+            for product_id, quantity in quantities.items():
                 try:
                     order_item = OrderItem.objects.get(
                         order=order,
                         product_id=product_id
                     )
 
-                    if int(quantity) <= 0:
+                    if quantity <= 0:
                         order_item.delete()
                     else:
-                        order_item.quantity = int(quantity)
+                        if quantity > order_item.quantity:
+                            added[product_id] = quantity - order_item.quantity
+                        order_item.quantity = quantity
                         order_item.save()
+                        # a pending order holds what it now contains
+                        StockHold.objects.filter(order_item=order_item).update(quantity=order_item.quantity)
 
                 except OrderItem.DoesNotExist:
                     continue
 
+            # more of a product needs the stock, like at checkout: a pending order holds it,
+            # a COD order takes the added units now
+            if added:
+                try:
+                    if order.status == 'pending':
+                        hold_order_stock(order)
+                    else:
+                        take_added_stock(order, added)
+                except CheckoutError as e:
+                    transaction.set_rollback(True)
+                    return Response({"error": e.message}, status=e.status)
+
+            items = list(order.items.select_related('product'))
+
             # If no items left → CANCEL order
-            if not order.items.exists():
+            if not items:
                 order.status = 'cancelled'
                 order.save()
 
@@ -81,22 +126,14 @@ class UpdateOrderView(APIView):
                     "message": "Order cancelled because it has no items"
                 }, status=200)
 
-            # Recalculate total
-            items_total = sum(
-                item.price * item.quantity
-                for item in order.items.all()
+            # Recalculate total, promotions and coupon the same way as the cart, from the
+            # unit prices charged at checkout
+            price = price_lines(
+                [Line(item.product.category_id, item.product.brand_id, item.price, item.quantity) for item in items],
+                order.coupon,
             )
-
-            # Recalculate discount if coupon exists
-            if order.coupon:
-                if order.coupon.discount_type == 'percentage':
-                    order.discount_amount = items_total * order.coupon.discount / 100
-                else:
-                    order.discount_amount = min(order.coupon.discount, items_total)
-            else:
-                order.discount_amount = 0
-
-            order.total_price = items_total - order.discount_amount
+            order.discount_amount = price.discount
+            order.total_price = price.total
 
         order.save()
 
@@ -12,9 +12,9 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
 from orders.models import Order
+from orders.checkout import hold_order_stock, CheckoutError
+from orders.holds import confirm_order_payment
 
-from django.db import transaction
-from django.db.models import F
 class PayOrderView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -31,15 +31,12 @@ class PayOrderView(APIView):
         if order.status != "pending":
             return Response({"error": "Order already processed"}, status=400)
 
-        # Check stock first
-        with transaction.atomic():
-            order = Order.objects.select_for_update().get(id=order.id)
-            for item in order.items.select_related("product").select_for_update():
-                if item.product.stock < item.quantity:
-                    return Response(
-                        {"error": f"Not enough stock for {item.product.name} only {item.product.stock} left"},
-                        status=409
-                )
+        # Hold the stock again for the time of the payment, in a short transaction of its own:
+        # no lock is kept while Paymob is called below
+        try:
+            hold_order_stock(order)
+        except CheckoutError as e:
+            return Response({"error": e.message}, status=e.status)
         
         # Get Auth Token
         auth_response = requests.post(
@@ -183,8 +180,8 @@ def paymob_webhook(request):
             if paymob_order_id:
                 try:
                     order = Order.objects.get(payment_reference=paymob_order_id)
-                    order.status = "paid"
-                    order.save()
+                    # takes the held stock, a no-op if the callback got there first
+                    confirm_order_payment(order.id)
                 except Order.DoesNotExist:
                     # Log this error in production instead of returning info
                     return Response({"error": "Order not found"}, status=404)
@@ -275,17 +272,7 @@ def paymob_callback(request):
                 try:
                     order = Order.objects.get(payment_reference=paymob_order_id)
                     if order.status != 'paid':
-                        with transaction.atomic():
-                            # Lock order row
-                            order = Order.objects.select_for_update().get(id=order.id)
-                            # Deduct stock
-                            for item in order.items.all():
-                                item.product.stock = F('stock') - item.quantity
-                                item.product.save()
-
-                            # Mark order paid
-                            order.status = "paid"
-                            order.save()
+                        confirm_order_payment(order.id)
                     return Response({"message": "Payment Successful", "order_id": order.id})
                 except Order.DoesNotExist:
                      return Response({"error": "Order not found"}, status=404)
@@ -296,17 +283,7 @@ def paymob_callback(request):
              try:
                 order = Order.objects.get(payment_reference=paymob_order_id)
                 if order.status != 'paid':
-                    with transaction.atomic():
-                        # Lock order row
-                        order = Order.objects.select_for_update().get(id=order.id)
-                        # Deduct stock
-                        for item in order.items.all():
-                            item.product.stock = F('stock') - item.quantity
-                            item.product.save()
-
-                        # Mark order paid
-                        order.status = "paid"
-                        order.save()
+                    confirm_order_payment(order.id)
                 return Response({"message": "Payment Successful", "order_id": order.id})
              except Order.DoesNotExist:
                  return Response({"error": "Order not found"}, status=404)
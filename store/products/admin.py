@@ -1,5 +1,8 @@
 from django.contrib import admin
+from django.db.models import Count
 from .models import Brand, Category, Product, ProductImage
+from .search import search_products
+from store.paginator import EstimatedCountPaginator
 
 # Register your models here.
 class ProductImageInline(admin.TabularInline):
@@ -11,23 +14,40 @@ class ProductAdmin(admin.ModelAdmin):
     inlines = [ProductImageInline]
     list_display = ('name', 'brand', 'price', 'discount', 'final_price', 'stock', 'description')
     list_filter = ('brand', 'category')
+    list_select_related = ('brand',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = ('name','description', 'brand__name', 'category__name')
 
+    # search through the search_vector/trigram indexes instead of ILIKE '%..%' on every column
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return search_products(queryset, search_term), False
+
 @admin.register(Brand) # change the way the brand model is displayed in admin panel
 class BrandAdmin(admin.ModelAdmin):
     list_display = ('name', 'product_count')
     search_fields = ('name',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(product_count=Count('product'))
 
-    # displays the number of products in each brand
+    # displays the number of products in each brand, counted in the changelist query
+    @admin.display(ordering='product_count')
     def product_count(self, obj):
-        return obj.product_set.count()
+        return obj.product_count
 
 @admin.register(Category) # change the way the category model is displayed in admin panel
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'category_count')
     search_fields = ('name',)
 
-    # displays the number of products in each category
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(category_count=Count('product'))
+
+    # displays the number of products in each category, counted in the changelist query
+    @admin.display(ordering='category_count')
     def category_count(self, obj):
-        return obj.product_set.count()
\ No newline at end of file
+        return obj.category_count
\ No newline at end of file
@@ -0,0 +1,59 @@
+import hashlib
+import time
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_RESPONSE_TIMEOUT = 60 * 60
+
+# The catalog version is part of every catalog cache key, so bumping it
+# invalidates all cached catalog data at once without deleting keys one by one.
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # start from the clock so a cache flush never reuses an old version number
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+def bump_catalog_version():
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError: # key missing (first run or evicted)
+        get_catalog_version()
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+class CatalogCacheMixin:
+    """
+    Serve GET responses of a catalog view from the shared cache.
+
+    The ETag is the catalog version plus a digest of the full URL and the response
+    format, so a matching If-None-Match is answered with 304 before any query runs,
+    and bodies are cached under the same pair.
+    """
+    # public data: without authentication a 304 doesn't even need a token lookup
+    authentication_classes = []
+
+    def get(self, request, *args, **kwargs):
+        version = get_catalog_version()
+        url = f'{request.accepted_renderer.format}:{request.build_absolute_uri()}'
+        digest = hashlib.md5(url.encode()).hexdigest()
+        etag = f'"{version}-{digest}"'
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=304, headers={'ETag': etag})
+
+        key = f'catalog:{version}:response:{digest}'
+        data = cache.get(key)
+        if data is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, response.data, CATALOG_RESPONSE_TIMEOUT)
+        else:
+            response = Response(data)
+
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,56 @@
+import hashlib
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Value, When
+from django.db.models.functions import Cast
+from .models import Product
+from .filters import VALUE_FILTERS, ID_FILTERS, FLAG_FILTERS, filter_products
+from .cache import get_catalog_version
+
+FACETS_CACHE_TIMEOUT = 60 * 10
+
+# SQL expression giving the facet value of each product, as text so all facets share one column type
+FACET_VALUES = {
+    **{name: Cast(name, CharField()) for name in VALUE_FILTERS},
+    **{name: Cast(f'{name}_id', CharField()) for name in ID_FILTERS},
+    'discounted': Case(When(discount__gt=0, then=Value('true')), default=Value('false'), output_field=CharField()),
+    'in_stock': Case(When(stock__gt=0, then=Value('true')), default=Value('false'), output_field=CharField()),
+}
+
+def compute_facets(filters):
+    """
+    Count products per value of every filterable attribute.
+
+    Each facet is counted against the current filters minus its own filter, so the
+    other options of an already selected facet keep their counts. All the grouped
+    counts are sent as a single UNION ALL query.
+    """
+    parts = [
+        filter_products(Product.objects.all(), filters, exclude=name)
+        .order_by()
+        .values(facet=Value(name, output_field=CharField()), value=expression)
+        .annotate(count=Count('id'))
+        for name, expression in FACET_VALUES.items()
+    ]
+
+    facets = {name: {} for name in FACET_VALUES}
+    for row in parts[0].union(*parts[1:], all=True):
+        if row['value'] is not None:
+            facets[row['facet']][row['value']] = row['count']
+
+    # Always report both states of the boolean switches
+    for name in FLAG_FILTERS:
+        facets[name] = {'true': facets[name].get('true', 0), 'false': facets[name].get('false', 0)}
+
+    return facets
+
+def get_facets(filters):
+    # cached per catalog version, so any product change invalidates every filter set
+    digest = hashlib.md5(urlencode(sorted(filters.items())).encode()).hexdigest()
+    key = f'catalog:{get_catalog_version()}:facets:{digest}'
+
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+    return facets
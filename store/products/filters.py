@@ -0,0 +1,74 @@
+from decimal import Decimal, InvalidOperation
+
+from .models import Product
+
+# Query parameters understood by the catalog endpoints
+VALUE_FILTERS = ('style', 'color', 'size', 'material')
+ID_FILTERS = ('category', 'brand')
+FLAG_FILTERS = ('discounted', 'in_stock')
+PRICE_FILTERS = {'min_price': 'final_price__gte', 'max_price': 'final_price__lte'} # on the price actually paid
+PRICE_FIELD = Product._meta.get_field('price')
+
+def normalize_filters(params):
+    """
+    Keep only the catalog filters from the query parameters, stripped and without
+    empty values, so equivalent requests map to the same filter set.
+    """
+    filters = {}
+    for name in VALUE_FILTERS:
+        value = (params.get(name) or '').strip()
+        if value:
+            filters[name] = value
+
+    for name in ID_FILTERS:
+        try:
+            filters[name] = str(int(params[name].strip()))
+        except (KeyError, ValueError): # missing or not a number
+            pass
+
+    for name in FLAG_FILTERS:
+        if params.get(name) == 'true':
+            filters[name] = 'true'
+
+    for name in PRICE_FILTERS:
+        price = parse_price(params.get(name))
+        if price is not None:
+            filters[name] = str(price)
+
+    return filters
+
+def parse_price(value):
+    # A price the price column can hold, rounded to cents, or None for a missing,
+    # non-numeric (NaN and Infinity included) or out of range value
+    try:
+        price = Decimal(value.strip())
+        if not price.is_finite():
+            return None
+        price = price.quantize(Decimal(10) ** -PRICE_FIELD.decimal_places)
+    except (AttributeError, InvalidOperation):
+        return None
+    if abs(price) >= 10 ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places):
+        return None
+    return price
+
+def filter_products(queryset, filters, exclude=None):
+    # Apply the normalized filters, optionally skipping one of them (used for facet counts)
+    if filters.get('discounted') and exclude != 'discounted':
+        queryset = queryset.filter(discount__gt=0)
+
+    if filters.get('in_stock') and exclude != 'in_stock':
+        queryset = queryset.filter(stock__gt=0)
+
+    for name in VALUE_FILTERS:
+        if filters.get(name) and exclude != name:
+            queryset = queryset.filter(**{name: filters[name]})
+
+    for name in ID_FILTERS:
+        if filters.get(name) and exclude != name:
+            queryset = queryset.filter(**{f'{name}_id': filters[name]})
+
+    for name, lookup in PRICE_FILTERS.items():
+        if filters.get(name):
+            queryset = queryset.filter(**{lookup: filters[name]})
+
+    return queryset
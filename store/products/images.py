@@ -0,0 +1,113 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps, features
+
+from .models import ProductImage
+from .cache import bump_catalog_version
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 480, 960) # cart/thumbnail, listing card, product page
+VARIANT_QUALITY = 80
+VARIANT_DIR = 'products/variants'
+
+# Background pool so uploads never wait for image processing
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='product-images')
+
+def variant_formats():
+    # AVIF needs a Pillow build with libavif
+    return [fmt for fmt in ('webp', 'avif') if features.check(fmt)]
+
+def build_variants(product_image):
+    """
+    Write the resized WebP/AVIF copies of an image and return the variants map.
+
+    Files are named after a hash of the original content, so rebuilding is idempotent
+    and identical uploads share their derivatives.
+    """
+    with product_image.image.open('rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+
+    source = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+    # never upscale: widths above the original are skipped, the smallest one is always built
+    widths = [width for width in VARIANT_WIDTHS if width < source.width] or [VARIANT_WIDTHS[0]]
+
+    variants = {'source': product_image.image.name}
+    for fmt in variant_formats():
+        variants[fmt] = {}
+        for width in widths:
+            name = f'{VARIANT_DIR}/{digest}-{width}.{fmt}'
+            if not default_storage.exists(name):
+                resized = source.copy()
+                resized.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+                buffer = BytesIO()
+                resized.save(buffer, format=fmt.upper(), quality=VARIANT_QUALITY)
+                default_storage.save(name, ContentFile(buffer.getvalue()))
+            variants[fmt][str(width)] = name
+    return variants
+
+def refresh_variants(image_id, force=False):
+    # Build and store the variants of one ProductImage, skipped when they are already current
+    product_image = ProductImage.objects.filter(pk=image_id).first()
+    if product_image is None or not product_image.image:
+        return False
+    if not force and product_image.variants.get('source') == product_image.image.name:
+        return False
+
+    variants = build_variants(product_image)
+    # update() doesn't send post_save, so this doesn't schedule the image again;
+    # the image filter skips the write if the file was replaced in the meantime
+    updated = ProductImage.objects.filter(pk=image_id, image=product_image.image.name).update(variants=variants)
+    if updated:
+        bump_catalog_version()
+    return bool(updated)
+
+def _refresh_in_background(image_id):
+    try:
+        refresh_variants(image_id)
+    except Exception:
+        logger.exception("Failed to build variants for product image %s", image_id)
+    finally:
+        # worker threads get their own DB connection, don't leak it
+        close_old_connections()
+
+def schedule_variants(image_id):
+    executor.submit(_refresh_in_background, image_id)
+
+def variant_urls(product_image, request=None):
+    # {format: {width: url}} for the variants that exist
+    urls = {}
+    for fmt, names in product_image.variants.items():
+        if fmt == 'source':
+            continue
+        urls[fmt] = {}
+        for width, name in names.items():
+            url = default_storage.url(name)
+            urls[fmt][width] = request.build_absolute_uri(url) if request else url
+    return urls
+
+def srcset(product_image, request=None):
+    # {format: "url 160w, url 480w, ..."} ready for <source srcset>
+    return {
+        fmt: ', '.join(f'{url} {width}w' for width, url in urls.items())
+        for fmt, urls in variant_urls(product_image, request).items()
+    }
+
+def thumbnail_url(product_image, request=None):
+    # Smallest WebP variant, the original until the variants are built
+    names = product_image.variants.get('webp')
+    if names:
+        url = default_storage.url(names[min(names, key=int)])
+        return request.build_absolute_uri(url) if request else url
+    url = product_image.image.url
+    return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.recommendations import TOP_K, build_related_products
+
+
+class Command(BaseCommand):
+    help = "Update the \"bought together\" related products from the orders placed since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help="Related products kept per product")
+        parser.add_argument('--min-orders', type=int, default=1, help="Orders two products must share to be related")
+        parser.add_argument('--rebuild', action='store_true', help="Forget the stored counts and rescan every order")
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        orders, products = build_related_products(
+            top_k=options['top_k'],
+            min_orders=options['min_orders'],
+            rebuild=options['rebuild'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {orders} new orders, refreshed {products} products in {time.monotonic() - start:.1f}s"
+        ))
@@ -0,0 +1,163 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from products.models import Brand, Category, Product
+from products.cache import bump_catalog_version
+from products.filters import parse_price
+
+# Columns copied as they are from the file to the product
+TEXT_FIELDS = ('description', 'style', 'color', 'size', 'material')
+# Longest value of each length limited column, a longer one skips the row instead of failing the batch
+MAX_LENGTHS = {
+    **{
+        name: Product._meta.get_field(name).max_length
+        for name in ('sku', 'name', *TEXT_FIELDS) if Product._meta.get_field(name).max_length
+    },
+    'category': Category._meta.get_field('name').max_length,
+    'brand': Brand._meta.get_field('name').max_length,
+}
+# Range of each integer column, an out of range value skips the row like a too long one
+INTEGER_RANGES = {
+    name: connection.ops.integer_field_range(Product._meta.get_field(name).get_internal_type())
+    for name in ('discount', 'stock')
+}
+# Columns rewritten when the sku already exists
+UPDATE_FIELDS = ['name', 'category', 'brand', 'price', 'discount', 'stock', *TEXT_FIELDS]
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert products from a CSV or JSON Lines file, matched on sku. "
+        "Columns: sku, name, category, brand, price, discount, stock, description, style, color, size, material"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        batch_size = options['batch_size']
+
+        # name -> id, filled lazily so each brand/category is looked up once per import
+        self.brand_ids = {}
+        self.category_ids = {}
+        self.imported = 0
+        self.skipped = 0
+        start = time.monotonic()
+
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                rows = self.read_rows(file, file_format)
+                # the file is streamed: only one batch of rows is in memory at a time
+                while batch := list(islice(rows, batch_size)):
+                    self.import_batch(batch)
+                    elapsed = time.monotonic() - start
+                    self.stdout.write(
+                        f"{self.imported} rows imported, {self.skipped} skipped ({self.imported / elapsed:.0f} rows/s)"
+                    )
+        except OSError as e:
+            raise CommandError(f"Can't read {path}: {e}")
+
+        if self.imported:
+            # bulk writes don't send post_save, invalidate the catalog caches once
+            bump_catalog_version()
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} rows ({self.skipped} skipped) in {elapsed:.1f}s, "
+            f"{self.imported / elapsed if elapsed else 0:.0f} rows/s"
+        ))
+
+    def read_rows(self, file, file_format):
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        yield None # counted as skipped by parse_row
+
+    def parse_row(self, row):
+        # Return the product values of a row, or None when the row is invalid
+        if not isinstance(row, dict): # a JSONL line that isn't an object
+            return None
+        try:
+            values = {
+                'sku': str(row['sku']).strip(),
+                'name': str(row['name']).strip(),
+                'category': str(row['category']).strip(),
+                'brand': str(row['brand']).strip(),
+                # finite and within the column's digits, the same check as the price filters
+                'price': parse_price(str(row['price'])),
+                'discount': int(row.get('discount') or 0),
+                'stock': int(row.get('stock') or 0),
+            }
+        except (KeyError, TypeError, ValueError, OverflowError):
+            return None
+
+        for field in TEXT_FIELDS:
+            value = row.get(field)
+            values[field] = str(value) if value else ('' if field == 'description' else None)
+
+        if not (values['sku'] and values['name'] and values['category'] and values['brand']):
+            return None
+        if any(values[name] and len(values[name]) > max_length for name, max_length in MAX_LENGTHS.items()):
+            return None
+        if values['price'] is None or values['price'] < 0:
+            return None
+        if any(not low <= values[name] <= high for name, (low, high) in INTEGER_RANGES.items()):
+            return None
+        # same rule as Product.save, which bulk inserts bypass
+        if values['stock'] <= 0:
+            return None
+        return values
+
+    def resolve_ids(self, model, names, ids):
+        # Fill ids with name -> pk for the given names, creating the missing rows in one insert
+        missing = names - ids.keys()
+        if not missing:
+            return
+        for pk, name in model.objects.filter(name__in=missing).values_list('pk', 'name'):
+            ids.setdefault(name, pk)
+        missing -= ids.keys()
+        if missing:
+            for obj in model.objects.bulk_create([model(name=name) for name in missing]):
+                ids[obj.name] = obj.pk
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        # keyed by sku: a sku repeated inside one batch can't be upserted twice by the same statement
+        rows = {}
+        for row in batch:
+            values = self.parse_row(row)
+            if values is None:
+                self.skipped += 1
+                continue
+            rows[values['sku']] = values
+
+        self.resolve_ids(Brand, {values['brand'] for values in rows.values()}, self.brand_ids)
+        self.resolve_ids(Category, {values['category'] for values in rows.values()}, self.category_ids)
+
+        products = []
+        for values in rows.values():
+            values['brand_id'] = self.brand_ids[values.pop('brand')]
+            values['category_id'] = self.category_ids[values.pop('category')]
+            products.append(Product(**values))
+
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=UPDATE_FIELDS,
+        )
+        self.imported += len(products)
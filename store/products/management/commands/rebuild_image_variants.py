@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from products.models import ProductImage
+from products.images import refresh_variants
+
+
+class Command(BaseCommand):
+    help = "Build the resized WebP/AVIF variants of product images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild images whose variants are already current")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        force = options['all']
+        batch_size = options['batch_size']
+
+        def refresh(image_id):
+            try:
+                return refresh_variants(image_id, force=force)
+            finally:
+                close_old_connections()
+
+        ids = ProductImage.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+        built = 0
+        start = time.monotonic()
+        # Pillow releases the GIL while resizing/encoding, so threads keep the cores busy
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while batch := list(islice(ids, batch_size)):
+                built += sum(executor.map(refresh, batch))
+                self.stdout.write(f"{built} images built")
+
+        self.stdout.write(self.style.SUCCESS(f"Built variants for {built} images in {time.monotonic() - start:.1f}s"))
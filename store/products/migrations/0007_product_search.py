@@ -0,0 +1,86 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:17
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Keeps products_product.search_vector current on every insert/update, including
+# bulk inserts that never call Product.save(), and when a brand or category is renamed.
+SEARCH_VECTOR_TRIGGERS = """
+CREATE OR REPLACE FUNCTION products_product_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce((SELECT name FROM products_brand WHERE id = NEW.brand_id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce((SELECT name FROM products_category WHERE id = NEW.category_id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_product_search_vector_trigger
+BEFORE INSERT OR UPDATE OF name, description, brand_id, category_id ON products_product
+FOR EACH ROW EXECUTE FUNCTION products_product_search_vector();
+
+CREATE OR REPLACE FUNCTION products_brand_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE products_product SET brand_id = brand_id WHERE brand_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_brand_search_vector_trigger
+AFTER UPDATE OF name ON products_brand
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION products_brand_search_vector();
+
+CREATE OR REPLACE FUNCTION products_category_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE products_product SET category_id = category_id WHERE category_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_category_search_vector_trigger
+AFTER UPDATE OF name ON products_category
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION products_category_search_vector();
+
+-- fill the column for the existing products
+UPDATE products_product SET name = name;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGERS = """
+DROP TRIGGER IF EXISTS products_category_search_vector_trigger ON products_category;
+DROP FUNCTION IF EXISTS products_category_search_vector();
+DROP TRIGGER IF EXISTS products_brand_search_vector_trigger ON products_brand;
+DROP FUNCTION IF EXISTS products_brand_search_vector();
+DROP TRIGGER IF EXISTS products_product_search_vector_trigger ON products_product;
+DROP FUNCTION IF EXISTS products_product_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_catalog_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGERS, DROP_SEARCH_VECTOR_TRIGGERS),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='product_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
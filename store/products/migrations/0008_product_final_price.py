@@ -0,0 +1,24 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:18
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('price'), '*', django.db.models.expressions.CombinedExpression(models.Value(100), '-', django.db.models.functions.comparison.Least('discount', models.Value(100)))), '/', models.Value(100)), output_field=models.DecimalField(decimal_places=2, max_digits=8)),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['final_price', 'id'], name='product_final_price_id_idx'),
+        ),
+    ]
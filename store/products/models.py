@@ -1,4 +1,7 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Least
 
 # Create your models here.
 class Category(models.Model):
@@ -13,7 +16,27 @@ class Brand(models.Model):
     def __str__(self):
         return self.name
      
+class ProductQuerySet(models.QuerySet):
+    # Everything the catalog serializers read, loaded in 2 queries whatever the page size:
+    # brand/category joined in, images fetched once for the whole page.
+    # With `fields` (sparse fieldsets) only the columns behind those fields are selected.
+    def for_catalog(self, fields=None):
+        if fields is None:
+            queryset = self.defer('search_vector').select_related('category', 'brand')
+        else:
+            columns = {'id', 'price', 'final_price'} # always there for the pagination keys
+            for name in fields:
+                columns.update(self.model.FIELD_COLUMNS.get(name, ()))
+            queryset = self.only(*columns)
+
+        if fields is None or {'images', 'thumbnail'} & set(fields):
+            queryset = queryset.prefetch_related(
+                models.Prefetch('images', queryset=ProductImage.objects.order_by('id'))
+            )
+        return queryset
+
 class Product(models.Model):
+    sku = models.CharField(max_length= 64, unique= True, null= True, blank= True) # Stock keeping unit, the key used by catalog imports
     name  = models.CharField(max_length= 25)
     category = models.ForeignKey(Category, on_delete=models.CASCADE) # Each product belongs to one category when deleted, delete all products in that category
     price = models.DecimalField(max_digits= 8, decimal_places= 2)
@@ -25,12 +48,37 @@ class Product(models.Model):
     color = models.CharField(max_length= 20, blank= True, null= True)
     size = models.CharField(max_length= 20, blank= True, null= True)
     material = models.CharField(max_length= 20, blank= True, null= True)
+    # name/brand/category/description as a tsvector, kept current by a database trigger (see migration 0007)
+    search_vector = SearchVectorField(null= True, editable= False)
+    # Final price after applying discount, computed and stored by the database so it can be
+    # filtered, sorted and indexed. LEAST ensures discount does not exceed 100%
+    final_price = models.GeneratedField(
+        expression=models.F('price') * (100 - Least('discount', models.Value(100))) / 100,
+        output_field=models.DecimalField(max_digits= 8, decimal_places= 2),
+        db_persist=True,
+    )
+
+    objects = ProductQuerySet.as_manager()
+
+    # serialized field -> columns it reads, for ProductQuerySet.for_catalog(fields)
+    FIELD_COLUMNS = {
+        'id': ('id',),
+        'sku': ('sku',),
+        'name': ('name',),
+        'category': ('category',),
+        'price': ('price',),
+        'brand': ('brand',),
+        'discount': ('discount',),
+        'stock': ('stock',),
+        'in_stock': ('stock',),
+        'description': ('description',),
+        'style': ('style',),
+        'color': ('color',),
+        'size': ('size',),
+        'material': ('material',),
+        'final_price': ('final_price',),
+    }
 
-    # Calculate the final price after applying discount
-    @property
-    def final_price(self):
-        discount_validation = min(self.discount, 100) # Ensure discount does not exceed 100%
-        return self.price * (100 - discount_validation) / 100
 
     # Check if the product is in stock
     @property
@@ -45,6 +93,26 @@ class Product(models.Model):
     
     def __str__(self):
         return self.name
+
+    class Meta:
+        # Composite indexes for the catalog filters, each ending with the pagination key
+        # so a filtered page is a single index range scan
+        indexes = [
+            models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+            models.Index(fields=['brand', 'id'], name='product_brand_id_idx'),
+            models.Index(fields=['style', 'id'], name='product_style_id_idx'),
+            models.Index(fields=['color', 'id'], name='product_color_id_idx'),
+            models.Index(fields=['size', 'id'], name='product_size_id_idx'),
+            models.Index(fields=['material', 'id'], name='product_material_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['final_price', 'id'], name='product_final_price_id_idx'),
+            # partial indexes for the in_stock / discounted switches
+            models.Index(fields=['id'], condition=models.Q(stock__gt=0), name='product_in_stock_idx'),
+            models.Index(fields=['id'], condition=models.Q(discount__gt=0), name='product_discounted_idx'),
+            # full-text search and the trigram (typo tolerant) fallback on the name
+            GinIndex(fields=['search_vector'], name='product_search_idx'),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx'),
+        ]
     
 class ProductImage(models.Model):
     product = models.ForeignKey(
@@ -52,4 +120,37 @@ class ProductImage(models.Model):
         on_delete=models.CASCADE, # when a product is deleted, delete all associated images
         related_name='images' # allows accessing images of a product using product.images.all()
     )
-    image = models.ImageField(upload_to='products/') # Store images in 'products/' directory
\ No newline at end of file
+    image = models.ImageField(upload_to='products/') # Store images in 'products/' directory
+    # resized copies built in the background: {"source": <image name>, "webp": {"160": <file name>, ...}, "avif": {...}}
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+# Number of orders containing both products, maintained incrementally by the related
+# products job. The diagonal (product == other) counts the orders containing the product.
+class ProductPair(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='unique_product_pair')
+        ]
+
+# Top "bought together" neighbours of each product, served by /api/products/<pk>/related/
+class RelatedProduct(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', related_query_name='recommended_for')
+    score = models.FloatField() # cosine similarity of the two products' orders
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # also the index behind the endpoint's lookup
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_related_product_rank')
+        ]
+
+# One row per run of the related products job, the last one marks where the next run resumes
+class RelatedProductsRun(models.Model):
+    last_order_id = models.BigIntegerField()
+    orders = models.PositiveIntegerField()
+    finished_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,117 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+# Keyset pagination for the catalog. Every ordering ends with the id and the cursor holds
+# all the ordering values of the row it stops at, so the next page is
+# "WHERE (price, id) > (cursor price, cursor id) LIMIT n": page N costs the same as page 1,
+# also through runs of equal prices (DRF's own cursor only keys on the first field and
+# steps over ties with an OFFSET)
+class ProductCursorPagination(CursorPagination):
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-id',) # newest first by default
+    ordering_param = 'ordering'
+
+    # allowed ?ordering= values, each ends with the id so the order is always stable
+    ordering_options = {
+        'newest': ('-id',),
+        'oldest': ('id',),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+        'final_price': ('final_price', 'id'),
+        '-final_price': ('-final_price', '-id'),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        ordering = self.ordering_options.get(request.query_params.get(self.ordering_param))
+        if ordering:
+            return ordering
+        # search results come annotated with their relevance
+        if 'rank' in queryset.query.annotations:
+            return ('-rank', '-id')
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # DRF's paging without the offset: positions are unique, so a page always starts
+        # right after (or, going back, right before) the row in the cursor
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+
+        if reverse:
+            queryset = queryset.order_by(*[
+                order[1:] if order.startswith('-') else '-' + order for order in self.ordering
+            ])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = self.filter_after(queryset, position, reverse)
+
+        # one extra row tells whether there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = None
+        if len(results) > self.page_size:
+            following = self._get_position_from_instance(results[-1], self.ordering)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None, position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def filter_after(self, queryset, position, reverse):
+        # Rows past the position in the page direction:
+        # f1 > v1 OR (f1 = v1 AND f2 > v2) ..., and f1 >= v1 so the database range
+        # scans the (f1, f2) index from the position instead of filtering every row
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        after, equal = Q(), Q()
+        for order, value in zip(self.ordering, values):
+            field = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+            after |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        field = self.ordering[0].lstrip('-')
+        lookup = 'lte' if self.ordering[0].startswith('-') != reverse else 'gte'
+        try:
+            return queryset.filter(Q(**{f'{field}__{lookup}': values[0]}), after)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def decode_cursor(self, request):
+        # the position alone marks where a page starts, offsets are never needed
+        cursor = super().decode_cursor(request)
+        return cursor and cursor._replace(offset=0)
+
+    def _get_position_from_instance(self, instance, ordering):
+        # the values of all the ordering fields, the id makes every position unique
+        fields = [order.lstrip('-') for order in ordering]
+        if isinstance(instance, dict):
+            values = [instance[field] for field in fields]
+        else:
+            values = [getattr(instance, field) for field in fields]
+        return json.dumps([str(value) for value in values], separators=(',', ':'))
@@ -0,0 +1,159 @@
+from datetime import timedelta
+
+import numpy as np
+from scipy import sparse
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from .models import Product, ProductPair, RelatedProduct, RelatedProductsRun
+from .cache import bump_catalog_version
+
+TOP_K = 12
+CHUNK_ORDERS = 20000 # orders per co-occurrence chunk, bounds the memory of a run
+CHUNK_PRODUCTS = 1000 # products per top-K batch
+# Orders newer than this are left for the next run: ids are allocated before commit,
+# so a recent order with a lower id may still be invisible when the watermark passes it
+SETTLE_TIME = timedelta(minutes=5)
+
+def co_occurrence(order_ids, product_ids, size):
+    """
+    Count the orders containing each pair of products as a size x size sparse matrix.
+
+    B is the order x product incidence matrix (1 when the order contains the product),
+    so (B.T @ B)[a, b] is the number of orders with both a and b, and the diagonal is
+    the number of orders with each product.
+    """
+    orders, rows = np.unique(order_ids, return_inverse=True)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, product_ids)),
+        shape=(len(orders), size),
+    )
+    incidence.data[:] = 1 # a product on two lines of the same order counts once
+    return (incidence.T @ incidence).tocsr()
+
+def scan_orders(after_id, upto_id, size):
+    # Co-occurrence of the orders in (after_id, upto_id], read CHUNK_ORDERS orders at a time
+    counts = sparse.csr_matrix((size, size), dtype=np.int32)
+    orders = 0
+    for start in range(after_id, upto_id, CHUNK_ORDERS):
+        rows = np.array(
+            OrderItem.objects
+            .filter(order_id__gt=start, order_id__lte=min(start + CHUNK_ORDERS, upto_id))
+            .exclude(order__status='cancelled')
+            .values_list('order_id', 'product_id'),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        if len(rows):
+            orders += len(np.unique(rows[:, 0]))
+            counts = counts + co_occurrence(rows[:, 0], rows[:, 1], size)
+    return counts.tocoo(), orders
+
+def save_pairs(counts):
+    # Add the new counts to the stored ones, one upsert per chunk of pairs
+    size = 10000
+    with connection.cursor() as cursor:
+        for start in range(0, counts.nnz, size):
+            end = start + size
+            cursor.execute(
+                f"""
+                INSERT INTO {ProductPair._meta.db_table} (product_id, other_id, orders)
+                SELECT pair.product_id, pair.other_id, pair.orders
+                FROM unnest(%s::integer[], %s::integer[], %s::integer[]) AS pair(product_id, other_id, orders)
+                WHERE pair.product_id IN (SELECT id FROM {Product._meta.db_table})
+                  AND pair.other_id IN (SELECT id FROM {Product._meta.db_table})
+                ON CONFLICT (product_id, other_id)
+                DO UPDATE SET orders = {ProductPair._meta.db_table}.orders + EXCLUDED.orders
+                """,
+                [
+                    counts.row[start:end].tolist(),
+                    counts.col[start:end].tolist(),
+                    counts.data[start:end].tolist(),
+                ],
+            )
+
+def top_neighbours(product_ids, top_k, min_orders):
+    """
+    Return the RelatedProduct rows of the given products.
+
+    The score is the cosine similarity of the two products' orders,
+    orders(a, b) / sqrt(orders(a) * orders(b)), so best sellers don't end up
+    related to everything.
+    """
+    pairs = np.array(
+        ProductPair.objects
+        .filter(product_id__in=product_ids, orders__gte=min_orders)
+        .values_list('product_id', 'other_id', 'orders'),
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    if not len(pairs):
+        return []
+
+    ids = np.unique(pairs[:, :2])
+    totals = dict(
+        ProductPair.objects
+        .filter(product_id__in=ids.tolist(), other_id=F('product_id'))
+        .values_list('product_id', 'orders')
+    )
+    diagonal = np.array([totals.get(pk, 0) for pk in ids.tolist()], dtype=np.float64)
+
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    product, other, orders = pairs[:, 0], pairs[:, 1], pairs[:, 2]
+    norms = np.sqrt(diagonal[np.searchsorted(ids, product)] * diagonal[np.searchsorted(ids, other)])
+    scores = np.divide(orders, norms, out=np.zeros(len(orders)), where=norms > 0)
+
+    # by product, then best score first (ties broken by id so runs are stable)
+    order = np.lexsort((other, -scores, product))
+    product, other, scores = product[order], other[order], scores[order]
+    # rank within each product's group: position minus the position where the group starts
+    starts = np.flatnonzero(np.r_[True, product[1:] != product[:-1]])
+    ranks = np.arange(len(product)) - np.repeat(starts, np.diff(np.r_[starts, len(product)]))
+    keep = ranks < top_k
+
+    return [
+        RelatedProduct(product_id=a, related_id=b, score=score, rank=rank)
+        for a, b, score, rank in zip(
+            product[keep].tolist(), other[keep].tolist(), scores[keep].tolist(), ranks[keep].tolist()
+        )
+    ]
+
+def build_related_products(top_k=TOP_K, min_orders=1, rebuild=False, settle=SETTLE_TIME):
+    """
+    Fold the orders placed since the last run into the pair counts and refresh the
+    related products of every product whose scores changed.
+
+    Returns (orders read, products refreshed).
+    """
+    with transaction.atomic():
+        if rebuild:
+            ProductPair.objects.all().delete()
+            RelatedProduct.objects.all().delete()
+            RelatedProductsRun.objects.all().delete()
+
+        last_run = RelatedProductsRun.objects.order_by('-id').first()
+        after_id = last_run.last_order_id if last_run else 0
+        upto_id = Order.objects.filter(created_at__lte=timezone.now() - settle).aggregate(Max('id'))['id__max'] or 0
+        if upto_id <= after_id:
+            return 0, 0
+
+        size = (Product.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        counts, orders = scan_orders(after_id, upto_id, size)
+        save_pairs(counts)
+        RelatedProductsRun.objects.create(last_order_id=upto_id, orders=orders)
+
+        # a new order changes the counts of its products, and through orders(b) the score
+        # of every product already paired with one of them
+        touched = np.unique(counts.row).tolist()
+        affected = sorted(set(
+            ProductPair.objects.filter(other_id__in=touched).values_list('product_id', flat=True)
+        ))
+        for start in range(0, len(affected), CHUNK_PRODUCTS):
+            chunk = affected[start:start + CHUNK_PRODUCTS]
+            RelatedProduct.objects.filter(product_id__in=chunk).delete()
+            RelatedProduct.objects.bulk_create(top_neighbours(chunk, top_k, min_orders))
+
+    if affected:
+        # bulk writes don't send post_save, the cached /related/ responses are stale
+        bump_catalog_version()
+    return orders, len(affected)
@@ -0,0 +1,25 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, IntegerField
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = 'english' # must match the text search config used by the search_vector trigger
+
+# Ranks are stored as integers so they can be used as an exact cursor position
+RANK_SCALE = 1000000
+
+def search_products(queryset, q):
+    """
+    Full-text search over name/brand/category/description using the search_vector
+    GIN index, ranked by relevance. When nothing matches (typically a typo) fall
+    back to trigram similarity on the name, served by the gin_trgm_ops index.
+    """
+    query = SearchQuery(q, search_type='websearch', config=SEARCH_CONFIG)
+    matches = queryset.filter(search_vector=query).annotate(
+        rank=Cast(SearchRank(F('search_vector'), query) * RANK_SCALE, IntegerField())
+    )
+    if matches.exists():
+        return matches
+
+    return queryset.filter(name__trigram_similar=q).annotate(
+        rank=Cast(TrigramSimilarity('name', q) * RANK_SCALE, IntegerField())
+    )
@@ -1,25 +1,78 @@
+from functools import cache
 from rest_framework import serializers
 from .models import Product, ProductImage
+from .images import variant_urls, srcset, thumbnail_url
+
+def requested_fields(request):
+    # ?fields=id,name,... as a list of the known fields, None when the parameter isn't
+    # given or names none of them (unknown names are ignored, like invalid filters)
+    value = request.query_params.get('fields') if request else None
+    if not value:
+        return None
+    known = product_field_names()
+    return [name.strip() for name in value.split(',') if name.strip() in known] or None
+
+@cache
+def product_field_names():
+    return frozenset(ProductSerializer().fields)
+
+def first_image(product):
+    # first image from the prefetched images, without a query per product
+    return next(iter(product.images.all()), None)
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(read_only=True)
+    variants = serializers.SerializerMethodField() # {format: {width: url}}, empty until they are built
+    srcset = serializers.SerializerMethodField() # {format: "url 160w, url 480w, ..."}
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants', 'srcset']
+
+    def get_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
+
+    def get_srcset(self, obj):
+        return srcset(obj, self.context.get('request'))
 
 # Serializer for Product model
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True) # Nested serializer for product images
-    final_price = serializers.SerializerMethodField() # Custom field to calculate final price after discount
+    in_stock = serializers.BooleanField(read_only=True)
+    thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         # Specify the model and fields to be serialized
         model = Product
-        fields = '__all__'
+        exclude = ['search_vector'] # final_price is a generated column, serialized read-only
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldsets: ?fields=id,name,final_price,thumbnail drops every other field
+        fields = requested_fields(self.context.get('request'))
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_thumbnail(self, obj):
+        image = first_image(obj)
+        if image:
+            return thumbnail_url(image, self.context.get('request'))
+        return None
+
+
+# Compact representation used by the product listing
+class ProductCardSerializer(serializers.ModelSerializer):
+    in_stock = serializers.BooleanField(read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'category', 'brand', 'price', 'discount', 'final_price', 'in_stock', 'thumbnail']
+
+    def get_thumbnail(self, obj):
+        image = first_image(obj)
+        if image:
+            return thumbnail_url(image, self.context.get('request'))
+        return None
 
-    def get_final_price(self, obj):
-        if obj.discount:
-            return obj.price - (obj.price * obj.discount / 100)
-        return obj.price
-    
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Brand, Category, Product, ProductImage
+from .cache import bump_catalog_version
+from .images import schedule_variants
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, instance, **kwargs):
+    # Any catalog change makes the cached catalog data (responses, ETags, facet counts) stale.
+    # After commit, like cart_changed: bumped earlier, a concurrent request could cache the
+    # old rows under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, **kwargs):
+    # (Re)build the resized variants in the background once the upload is committed
+    if instance.image and instance.variants.get('source') != instance.image.name:
+        transaction.on_commit(lambda: schedule_variants(instance.pk))
@@ -1,3 +1,420 @@
-from django.test import TestCase
+import base64
+import os
+import tempfile
+from io import BytesIO, StringIO
+from urllib.parse import urlencode
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from PIL import Image
+from products.models import Product, Category, Brand, ProductImage
+from products.images import refresh_variants
+from products.recommendations import build_related_products
+from datetime import timedelta
+from django.contrib.auth.models import User
+from orders.models import Order, OrderItem
+from decimal import Decimal
 
-# Create your tests here.
+class ProductPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Bags')
+        self.brand = Brand.objects.create(name='Moda')
+        for i in range(7):
+            Product.objects.create(
+                name=f'Product {i}',
+                price=Decimal(100 + i * 10),
+                category=self.category,
+                brand=self.brand,
+                stock=5
+            )
+
+    def collect_pages(self, url):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names += [product['name'] for product in response.data['results']]
+            url = response.data['next']
+        return names
+
+    def test_cursor_pages_cover_catalog_once(self):
+        names = self.collect_pages('/api/products/?page_size=3')
+        self.assertEqual(names, [f'Product {i}' for i in reversed(range(7))])
+
+    def test_cursor_pages_ordered_by_price(self):
+        names = self.collect_pages('/api/products/?page_size=2&ordering=price')
+        self.assertEqual(names, [f'Product {i}' for i in range(7)])
+
+    def test_final_price_range_and_ordering(self):
+        product = Product.objects.get(name='Product 6') # 160 with 50% off
+        product.discount = 50
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.final_price, Decimal('80.00'))
+
+        names = self.collect_pages('/api/products/?min_price=80&max_price=120&ordering=-final_price')
+        self.assertEqual(names, ['Product 2', 'Product 1', 'Product 0', 'Product 6'])
+
+    def test_invalid_price_filters_are_ignored(self):
+        for value in ['NaN', 'Infinity', '-Infinity', '1e400', '99999999', 'abc']:
+            response = self.client.get('/api/products/', {'min_price': value, 'max_price': value})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), 7)
+            response = self.client.get('/api/products/facets/', {'min_price': value})
+            self.assertEqual(response.status_code, 200)
+
+    def test_cursor_pages_through_equal_prices(self):
+        Product.objects.update(price=Decimal('100.00'))
+        names = self.collect_pages('/api/products/?page_size=2&ordering=-price')
+        self.assertEqual(names, [f'Product {i}' for i in reversed(range(7))])
+
+        # the cursor keys on (price, id), ties never turn into an OFFSET
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/?page_size=2&ordering=price')
+            response = self.client.get(response.data['next'])
+        self.assertNotIn('OFFSET', queries[-1]['sql'])
+        self.assertEqual([product['name'] for product in response.data['results']], ['Product 2', 'Product 3'])
+
+        # and back again
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([product['name'] for product in response.data['results']], ['Product 0', 'Product 1'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_invalid_cursor(self):
+        for position in ['["100.00"]', '["abc","1"]', 'abc']:
+            cursor = base64.b64encode(urlencode({'p': position}).encode()).decode()
+            response = self.client.get('/api/products/', {'ordering': 'price', 'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class ProductQueryCountTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shoes')
+        brand = Brand.objects.create(name='Moda')
+        for i in range(30):
+            product = Product.objects.create(
+                name=f'Product {i}',
+                price=Decimal('50.00'),
+                category=category,
+                brand=brand,
+                stock=3
+            )
+            ProductImage.objects.create(product=product, image=f'products/{i}-a.png')
+            ProductImage.objects.create(product=product, image=f'products/{i}-b.png')
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        # one query for the page of products and one for their images
+        for page_size in (1, 10, 30):
+            with self.assertNumQueries(2):
+                response = self.client.get(f'/api/products/?page_size={page_size}')
+            self.assertEqual(len(response.data['results']), page_size)
+            self.assertTrue(response.data['results'][0]['thumbnail'].endswith('-a.png'))
+
+    def test_sparse_fields(self):
+        with self.assertNumQueries(1): # no images requested, no images query
+            response = self.client.get('/api/products/?fields=id,name,final_price')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'final_price'})
+
+        response = self.client.get('/api/products/?fields=id,images&page_size=5')
+        self.assertEqual(len(response.data['results'][0]['images']), 2)
+
+    def test_unknown_fields_are_ignored(self):
+        response = self.client.get('/api/products/?fields=id,foo')
+        self.assertEqual(set(response.data['results'][0]), {'id'})
+
+        # nothing known asked for: the default representations
+        response = self.client.get('/api/products/?fields=foo')
+        self.assertIn('thumbnail', response.data['results'][0])
+        product = Product.objects.first()
+        response = self.client.get(f'/api/products/{product.id}/?fields=foo')
+        self.assertIn('description', response.data)
+        response = self.client.get(f'/api/products/batch/?ids={product.id}&fields=foo')
+        self.assertEqual(response.data[str(product.id)]['name'], product.name)
+
+    def test_detail_query_count(self):
+        product = Product.objects.first()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(len(response.data['images']), 2)
+
+
+class ProductFacetsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bags = Category.objects.create(name='Bags')
+        self.shoes = Category.objects.create(name='Shoes')
+        brand = Brand.objects.create(name='Moda')
+        for category, color, discount in [
+            (self.bags, 'black', 0),
+            (self.bags, 'black', 10),
+            (self.bags, 'red', 0),
+            (self.shoes, 'black', 20),
+        ]:
+            Product.objects.create(
+                name=f'{category} {color}',
+                price=Decimal('80.00'),
+                category=category,
+                brand=brand,
+                color=color,
+                discount=discount,
+                stock=2
+            )
+
+    def test_facet_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/products/facets/?category={self.bags.id}')
+        facets = response.data
+        # a facet ignores its own filter so the other categories stay selectable
+        self.assertEqual(facets['category'], {str(self.bags.id): 3, str(self.shoes.id): 1})
+        self.assertEqual(facets['color'], {'black': 2, 'red': 1})
+        self.assertEqual(facets['discounted'], {'true': 1, 'false': 2})
+        self.assertEqual(facets['in_stock'], {'true': 3, 'false': 0})
+
+    def test_non_numeric_ids_are_ignored(self):
+        for url in ['/api/products/facets/?category=abc', '/api/products/?brand=abc', '/api/products/?category=99999999999999999999']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/products/facets/?category=abc').data['color'], {'black': 3, 'red': 1})
+
+    def test_facets_cached_until_product_changes(self):
+        url = '/api/products/facets/?color=black'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        product = Product.objects.get(color='red')
+        product.color = 'black'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['category'], {str(self.bags.id): 3, str(self.shoes.id): 1})
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        bags = Category.objects.create(name='Bags')
+        shoes = Category.objects.create(name='Shoes')
+        self.brand = Brand.objects.create(name='Dragon')
+        Product.objects.create(name='Rosanna Tote', category=bags, brand=self.brand,
+                               price=Decimal('300.00'), stock=4, description='Black leather tote bag')
+        Product.objects.create(name='Runner', category=shoes, brand=self.brand,
+                               price=Decimal('150.00'), stock=4, description='Light running shoe')
+
+    def search(self, q):
+        response = self.client.get('/api/products/', {'q': q})
+        return [product['name'] for product in response.data['results']]
+
+    def test_full_text_search_over_description_and_category(self):
+        self.assertEqual(self.search('leather'), ['Rosanna Tote'])
+        self.assertEqual(self.search('shoes'), ['Runner'])
+
+    def test_search_follows_brand_rename(self):
+        self.brand.name = 'Phoenix'
+        self.brand.save()
+        self.assertEqual(len(self.search('phoenix')), 2)
+
+    def test_typo_falls_back_to_trigram(self):
+        self.assertEqual(self.search('rosana tote'), ['Rosanna Tote'])
+
+
+class ProductHttpCacheTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Cap',
+            price=Decimal('20.00'),
+            category=Category.objects.create(name='Hats'),
+            brand=Brand.objects.create(name='Moda'),
+            stock=9
+        )
+        self.url = f'/api/products/{self.product.id}/'
+
+    def test_not_modified_without_queries(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_body_served_from_cache_until_catalog_changes(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data['name'], 'Cap')
+
+        # the catalog version is bumped on commit, the variants of the missing file aren't built
+        with mock.patch('products.signals.schedule_variants'), self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/cap.png')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['images']), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductImageVariantsTest(TestCase):
+    def test_variants_built_and_serialized(self):
+        product = Product.objects.create(
+            name='Tote',
+            price=Decimal('120.00'),
+            category=Category.objects.create(name='Bags'),
+            brand=Brand.objects.create(name='Moda'),
+            stock=1
+        )
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), 'red').save(buffer, format='PNG')
+        image = ProductImage(product=product)
+        image.image.save('tote.png', ContentFile(buffer.getvalue()))
+
+        self.assertTrue(refresh_variants(image.id))
+        self.assertFalse(refresh_variants(image.id)) # already current
+        image.refresh_from_db()
+        self.assertEqual(set(image.variants['webp']), {'160', '480'}) # no upscaling past 600px
+
+        response = self.client.get(f'/api/products/{product.id}/')
+        webp = response.data['images'][0]['variants']['webp']
+        self.assertTrue(webp['160'].endswith('-160.webp'))
+        self.assertIn(f"{webp['480']} 480w", response.data['images'][0]['srcset']['webp'])
+
+
+class ProductBatchTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Bags')
+        brand = Brand.objects.create(name='Moda')
+        self.products = [
+            Product.objects.create(name=f'Bag {i}', price=Decimal('10.00'), category=category, brand=brand, stock=1)
+            for i in range(5)
+        ]
+
+    def test_batch_keyed_by_id_in_constant_queries(self):
+        ids = [self.products[3].id, self.products[0].id, 999999]
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/batch/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(list(response.data), [str(ids[0]), str(ids[1])])
+        self.assertEqual(response.data[str(ids[0])]['name'], 'Bag 3')
+
+        response = self.client.post('/api/products/batch/', {'ids': ids}, content_type='application/json')
+        self.assertEqual(len(response.data), 2)
+
+    def test_batch_with_sparse_fields_without_id(self):
+        product = self.products[1]
+        response = self.client.get('/api/products/batch/', {'ids': str(product.id), 'fields': 'name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {str(product.id): {'name': 'Bag 1'}})
+
+    def test_batch_size_is_capped(self):
+        response = self.client.get('/api/products/batch/', {'ids': ','.join(str(i) for i in range(1, 102))})
+        self.assertEqual(response.status_code, 400)
+
+
+class RelatedProductsTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Bags')
+        brand = Brand.objects.create(name='Moda')
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.bag, self.belt, self.scarf, self.hat = [
+            Product.objects.create(name=name, price=Decimal('10.00'), category=category, brand=brand, stock=5)
+            for name in ('Bag', 'Belt', 'Scarf', 'Hat')
+        ]
+
+    def order(self, *products, status='paid'):
+        order = Order.objects.create(user=self.user, total_price=Decimal('10.00'), phone='0100', address='Cairo', status=status)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+
+    def related(self, product):
+        response = self.client.get(f'/api/products/{product.id}/related/')
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_related_ranked_by_cosine_similarity(self):
+        self.order(self.bag, self.belt)
+        self.order(self.bag, self.belt)
+        self.order(self.bag, self.scarf)
+        self.order(self.bag, self.hat, status='cancelled')
+        build_related_products(settle=timedelta(0))
+
+        self.assertEqual(self.related(self.bag), ['Belt', 'Scarf'])
+        self.assertEqual(self.related(self.belt), ['Bag'])
+        self.assertEqual(self.related(self.hat), [])
+
+    def test_runs_fold_in_new_orders_only(self):
+        self.order(self.bag, self.belt)
+        self.assertEqual(build_related_products(settle=timedelta(0)), (1, 2))
+        self.assertEqual(build_related_products(settle=timedelta(0)), (0, 0))
+
+        self.order(self.scarf, self.hat)
+        self.order(self.scarf, self.hat)
+        self.order(self.bag, self.scarf)
+        self.assertEqual(build_related_products(settle=timedelta(0))[0], 3)
+        self.assertEqual(self.related(self.scarf), ['Hat', 'Bag'])
+        self.assertEqual(self.related(self.bag), ['Belt', 'Scarf'])
+
+        # a rebuild rescans everything and ends with the same counts
+        build_related_products(rebuild=True, settle=timedelta(0))
+        self.assertEqual(self.related(self.scarf), ['Hat', 'Bag'])
+
+
+class ImportCatalogTest(TestCase):
+    def import_file(self, name, content):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out)
+        return out.getvalue()
+
+    def test_csv_and_jsonl_upsert_on_sku(self):
+        Product.objects.create(
+            sku='TOTE-1', name='Old name', price=Decimal('1.00'), stock=1,
+            category=Category.objects.create(name='Bags'), brand=Brand.objects.create(name='Moda')
+        )
+        out = self.import_file('catalog.csv', (
+            "sku,name,category,brand,price,discount,stock,color\n"
+            "TOTE-1,Rosanna Tote,Bags,Moda,300.00,10,4,black\n"
+            "CAP-1,Cap,Hats,Dragon,50.00,0,2,\n"
+            "BAD-1,No price,Hats,Dragon,,0,2,\n" # skipped: invalid price
+            f"LONG-1,Scarf,Hats,Dragon,20.00,0,2,{'x' * 21}\n" # skipped: color too long
+        ))
+        self.assertIn('Imported 2 rows (2 skipped)', out)
+        self.assertEqual(Product.objects.count(), 2)
+        tote = Product.objects.get(sku='TOTE-1')
+        self.assertEqual((tote.name, tote.price, tote.color), ('Rosanna Tote', Decimal('300.00'), 'black'))
+        # brand and category created on the fly
+        cap = Product.objects.select_related('category', 'brand').get(sku='CAP-1')
+        self.assertEqual((cap.category.name, cap.brand.name, cap.color), ('Hats', 'Dragon', None))
+
+        self.import_file('catalog.jsonl', (
+            '{"sku": "CAP-1", "name": "Cap", "category": "Hats", "brand": "Dragon", "price": 45, "stock": 3}\n'
+            '\n'
+            '{"sku": "SHOE-1", "name": "Runner", "category": "Shoes", "brand": "Dragon", "price": "150.00", "stock": 5, "size": 42}\n'
+            '{"sku": "GONE-1", "name": "Sold out", "category": "Shoes", "brand": "Dragon", "price": 10, "stock": 0}\n'
+        ))
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(Product.objects.get(sku='CAP-1').price, Decimal('45.00'))
+        self.assertEqual(Product.objects.get(sku='SHOE-1').size, '42')
+        self.assertEqual(Brand.objects.filter(name='Dragon').count(), 1)
+        self.assertEqual(Category.objects.count(), 3)
+
+    def test_bad_rows_are_skipped(self):
+        out = self.import_file('catalog.csv', (
+            "sku,name,category,brand,price,discount,stock\n"
+            "OK-1,Tote,Bags,Moda,10.00,0,1\n"
+            "BIG-1,Tote,Bags,Moda,123456789,0,1\n" # more digits than the column
+            "NAN-1,Tote,Bags,Moda,NaN,0,1\n"
+            "INF-1,Tote,Bags,Moda,Infinity,0,1\n"
+            "DISC-1,Tote,Bags,Moda,10.00,9999999999,1\n" # out of the integer range
+        ))
+        self.assertIn('Imported 1 rows (4 skipped)', out)
+
+        out = self.import_file('catalog.jsonl', (
+            '{"sku": "OK-2", "name": "Cap", "category": "Hats", "brand": "Moda", "price": 5, "stock": 1}\n'
+            '{"sku": "BROKEN", "name": \n'
+            '["not", "an", "object"]\n'
+            '{"sku": "INF-2", "name": "Cap", "category": "Hats", "brand": "Moda", "price": 5, "stock": Infinity}\n'
+            '{"sku": "LIST-1", "name": "Cap", "category": "Hats", "brand": "Moda", "price": 5, "stock": [1]}\n'
+        ))
+        self.assertIn('Imported 1 rows (4 skipped)', out)
+        self.assertEqual(set(Product.objects.values_list('sku', flat=True)), {'OK-1', 'OK-2'})
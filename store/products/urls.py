@@ -1,9 +1,12 @@
 from django.urls import path, include
-from .views import ProductListAPIView, ProductDetailAPIView
+from .views import ProductListAPIView, ProductDetailAPIView, ProductFacetsAPIView, ProductBatchAPIView, RelatedProductsAPIView
 from rest_framework.routers import DefaultRouter
 
 # Define URL patterns for product list and product detail views
 urlpatterns = [
     path('products/', ProductListAPIView.as_view()),
+    path('products/facets/', ProductFacetsAPIView.as_view()),
+    path('products/batch/', ProductBatchAPIView.as_view()),
     path('products/<int:pk>/', ProductDetailAPIView.as_view()),
+    path('products/<int:pk>/related/', RelatedProductsAPIView.as_view()),
 ]
\ No newline at end of file
@@ -1,49 +1,105 @@
 from django.shortcuts import render
 from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.views import APIView
+from rest_framework.response import Response
 from .models import Product
-from .serializers import ProductSerializer
+from .serializers import ProductSerializer, ProductCardSerializer, requested_fields
+from .pagination import ProductCursorPagination
+from .filters import normalize_filters, filter_products
+from .facets import get_facets
+from .search import search_products
+from .cache import CatalogCacheMixin
 
 # Create your views here.
 
 # API view to list all products
-class ProductListAPIView(ListAPIView):
+class ProductListAPIView(CatalogCacheMixin, ListAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination # ?cursor=...&page_size=...&ordering=newest|oldest|price|-price|final_price|-final_price
+
+    def get_serializer_class(self):
+        # compact cards unless specific fields are asked for
+        if requested_fields(self.request):
+            return ProductSerializer
+        return ProductCardSerializer
 
     def get_queryset(self):
-        queryset = Product.objects.all()
-        
+        # only the columns the response needs, so e.g. descriptions are never read for the listing
+        fields = requested_fields(self.request) or ProductCardSerializer.Meta.fields
         # Apply filters based on query parameters
-        if self.request.GET.get('discounted') == 'true':
-            queryset = queryset.filter(discount__gt=0)
+        filters = normalize_filters(self.request.GET)
+        queryset = filter_products(Product.objects.for_catalog(fields), filters)
 
-        if self.request.GET.get('in_stock') == 'true':
-            queryset = queryset.filter(stock__gt=0)
+        # ?q= search, results are ordered by relevance unless another ordering is asked for
+        q = self.request.GET.get('q', '').strip()
+        if q:
+            queryset = search_products(queryset, q)
 
-        if self.request.GET.get('style'):
-            queryset = queryset.filter(style=self.request.GET.get('style'))
+        return queryset
 
-        if self.request.GET.get('color'):
-            queryset = queryset.filter(color=self.request.GET.get('color'))
+    
+# API view to retrieve a single product by its ID
+class ProductDetailAPIView(CatalogCacheMixin, RetrieveAPIView):
+    queryset = Product.objects.for_catalog()
+    serializer_class = ProductSerializer # supports ?fields= too
 
-        if self.request.GET.get('size'):
-            queryset = queryset.filter(size=self.request.GET.get('size'))
+    def get_queryset(self):
+        return Product.objects.for_catalog(requested_fields(self.request))
 
-        if self.request.GET.get('material'):
-            queryset = queryset.filter(material=self.request.GET.get('material'))
 
-        category = self.request.GET.get('category')
-        if category:
-            queryset = queryset.filter(category_id=category)
+# API view listing the products most often bought together with a product,
+# precomputed by the build_related_products command
+class RelatedProductsAPIView(CatalogCacheMixin, ListAPIView):
+    serializer_class = ProductCardSerializer
+    pagination_class = None # at most TOP_K products
 
-        brand = self.request.GET.get('brand')
-        if brand:
-            queryset = queryset.filter(brand_id=brand)
+    def get_queryset(self):
+        # a single range scan of the (product, rank) index, joined to the products
+        return (
+            Product.objects.for_catalog(ProductCardSerializer.Meta.fields)
+            .filter(recommended_for__product_id=self.kwargs['pk'])
+            .order_by('recommended_for__rank')
+        )
 
-        return queryset
 
-    
-# API view to retrieve a single product by its ID
-class ProductDetailAPIView(RetrieveAPIView):
-    queryset = Product.objects.all()
-    serializer_class = ProductSerializer
+# API view returning the number of products per filter value for the current filters
+class ProductFacetsAPIView(APIView):
+
+    def get(self, request):
+        filters = normalize_filters(request.GET)
+        return Response(get_facets(filters))
+
+
+# API view returning several products at once, keyed by id: ?ids=1,2,3 or POST {"ids": [1, 2, 3]}
+class ProductBatchAPIView(APIView):
+    authentication_classes = [] # public catalog data
+    max_batch_size = 100
+
+    def get(self, request):
+        ids = [value for value in request.GET.get('ids', '').split(',') if value.strip()]
+        return self.batch(ids)
+
+    def post(self, request):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list):
+            return Response({"error": "ids must be a list"}, status=400)
+        return self.batch(ids)
+
+    def batch(self, ids):
+        try:
+            ids = list(dict.fromkeys(int(value) for value in ids)) # unique, in request order
+        except (TypeError, ValueError):
+            return Response({"error": "ids must be integers"}, status=400)
+
+        if not ids:
+            return Response({"error": "ids is required"}, status=400)
+        if len(ids) > self.max_batch_size:
+            return Response({"error": f"At most {self.max_batch_size} products per batch"}, status=400)
+
+        # one query for the products and one for their images, whatever the batch size
+        products = Product.objects.for_catalog(requested_fields(self.request)).in_bulk(ids)
+        products = [products[pk] for pk in ids if pk in products]
+        serializer = ProductSerializer(products, many=True, context={'request': self.request})
+        # keyed by the instances, ?fields= may leave id out of the serialized data
+        return Response({str(product.id): data for product, data in zip(products, serializer.data)})
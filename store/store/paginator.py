@@ -0,0 +1,27 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over large tables.
+
+    Without filters the row count comes from the planner statistics (pg_class.reltuples)
+    instead of a COUNT(*) that scans the whole table. Small or filtered lists keep
+    the exact count.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.exact_count_threshold:
+                return row[0]
+        return super().count
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'products.apps.ProductsConfig',
     'cart.apps.CartConfig',
     'django.contrib.sites',
@@ -203,6 +204,27 @@ else:
         }
     }
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+if REDIS_URL:
+    # Shared between all gunicorn workers / instances
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    # Local development
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 